@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+# utils/benchmark 离线性能测试：生成合成订阅语料，由本地 HTTP 服务提供，逐阶段测量吞吐与内存峰值
+#
+# 在 utils 目录下运行:
+#     python -m benchmark --nodes 1000,100000 --dup-ratio 0.3
+#     python -m benchmark --save-baseline      # 把本次结果写为本机的基线（benchmark/baseline.json，不提交）
+#     python -m benchmark                      # 与本机基线比较，退步超过 --tolerance 时返回 1
+
+from benchmark.corpus import build_corpus
+from benchmark.server import source_server
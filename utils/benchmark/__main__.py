@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# utils/benchmark/__main__.py 逐阶段测量吞吐（每秒节点数、MB/s）和内存峰值，并与保存的基线比较
+
+import argparse, contextlib, gc, json, os, shutil, sys, tempfile, time, tracemalloc
+import urllib.parse
+
+UTILS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, UTILS_DIR)
+
+from sub_node import parse_share_link, clash_to_share_link
+from sub_sniff import sniff_content
+from sub_emit import emit_outputs
+from sub_merge import merge, load_clash_proxies
+from benchmark.corpus import build_corpus, encode_source
+from benchmark.server import source_server
+
+# 基线与机器有关，由 --save-baseline 在本机生成，不提交到仓库
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# 参照工作量：紧挨着每个阶段前后各测一次，基线保存阶段吞吐与它的比值，换一台机器比较时不受绝对速度影响
+REFERENCE_SIZE = 5000
+
+def parse_size(text):
+    """'1000'、'10k'、'1m' → 整数"""
+    text = text.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * scale)
+
+def reference_work(links):
+    """与被测代码相近的纯 Python 工作量（拆分链接、解码备注、序列化），代码不随项目变化"""
+    for link in links:
+        parts = urllib.parse.urlsplit(link)
+        json.dumps((parts.scheme, parts.netloc, urllib.parse.unquote(parts.fragment)))
+
+def bare_merge():
+    """不下载也不写文件的 merge 实例，只用来调用 deduplicate_nodes"""
+    instance = merge.__new__(merge)
+    instance.deduplicate = True
+    instance.parse_workers, instance.parse_threshold, instance.parse_pool = 0, 20000, None
+    return instance
+
+def quiet(func, *args):
+    """屏蔽被测函数的进度输出"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return func(*args)
+
+class stage():
+    """
+    一个被测阶段。setup() 的返回值作为 run() 的参数，setup 不计时；
+    items 为处理的节点数，size 为处理的字节数（用于 MB/s，可为 0）。
+    """
+    def __init__(self, name, run, items, size=0, setup=None):
+        self.name, self.run, self.items, self.size = name, run, items, size
+        self.setup = setup or (lambda: ())
+
+    def measure(self, repeat, memory):
+        best = None
+        for _ in range(repeat):
+            args = self.setup()
+            gc.collect()
+            start = time.perf_counter()
+            self.run(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        result = {'items': self.items, 'seconds': round(best, 4),
+                  'per_sec': round(self.items / best, 1) if best else None,
+                  'mb_per_sec': round(self.size / best / 1048576, 2) if best and self.size else None}
+        if memory:
+            # 内存单独跑一遍，tracemalloc 的开销不计入耗时
+            args = self.setup()
+            gc.collect()
+            tracemalloc.start()
+            try:
+                self.run(*args)
+                result['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            finally:
+                tracemalloc.stop()
+        return result
+
+def merge_stages(corpus, work_dir, server):
+    """端到端 merge.sub_merge：无缓存的冷启动，以及源未变化时的增量运行"""
+    sources = [{'id': index, 'remarks': name, 'url': server.url(name), 'update_method': 'auto', 'enabled': True}
+               for index, name in enumerate(corpus['files'])]
+
+    def file_dir(name, cached):
+        root = os.path.join(work_dir, name)
+        shutil.rmtree(root, ignore_errors=True)
+        os.makedirs(root)
+        list_file = os.path.join(root, 'sub_list.json')
+        with open(list_file, 'w', encoding='utf-8') as f:
+            json.dump(sources, f)
+        config = {'list_dir': os.path.join(root, 'list') + '/', 'list_file': list_file, 'merge_dir': root + '/'}
+        if cached:
+            config.update(cache_dir=os.path.join(root, 'cache') + '/', incremental_merge='true')
+        return config
+
+    def warm_setup():
+        config = file_dir('warm', True)
+        quiet(merge, config, {}) # 预热缓存和增量状态，不计时
+        return config, {}
+
+    items = len(corpus['links'])
+    size = sum(len(body) for body in corpus['files'].values())
+    return [
+        stage('sub_merge.cold', lambda config, fmt: quiet(merge, config, fmt), items, size, lambda: (file_dir('cold', False), {})),
+        stage('sub_merge.warm', lambda config, fmt: quiet(merge, config, fmt), items, size, warm_setup),
+    ]
+
+def run_suite(count, dup_ratio, sources=8, repeat=3, memory=True, latency=0.0, seed=1):
+    """生成一份语料并测量所有阶段，返回 { 阶段名: 结果 }"""
+    start = time.perf_counter()
+    corpus = build_corpus(count, dup_ratio, sources, seed)
+    links = corpus['links']
+    print(f'Generated {len(links)} links in {len(corpus["files"])} sources ({time.perf_counter() - start:.1f}s).')
+    blob = encode_source(links, 'base64')
+    yaml_texts = [body.decode('utf-8') for name, body in corpus['files'].items() if corpus['formats'][name] == 'yaml']
+    proxies = [proxy for text in yaml_texts for proxy in load_clash_proxies(text)]
+    unique_links = sorted({node.fingerprint: node.link for node in map(parse_share_link, links) if node}.values())
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir, source_server(corpus['files'], latency) as server:
+        stages = [
+            stage('base64_decode', lambda: sniff_content(blob), len(links), len(blob)),
+            stage('parse_share_link', lambda: [parse_share_link(link) for link in links], len(links)),
+            stage('load_clash_proxies', lambda: [load_clash_proxies(text) for text in yaml_texts],
+                  len(proxies), sum(len(text) for text in yaml_texts)),
+            stage('clash_to_share_link', lambda: [clash_to_share_link(proxy) for proxy in proxies], len(proxies)),
+            stage('deduplicate_nodes', lambda: quiet(bare_merge().deduplicate_nodes, links), len(links)),
+            stage('emit_outputs', lambda: emit_outputs(work_dir, unique_links), len(unique_links)),
+        ] + merge_stages(corpus, work_dir, server)
+        sample = links[:REFERENCE_SIZE]
+        reference = stage('reference', lambda: reference_work(sample), len(sample))
+        for item in stages:
+            before = reference.measure(repeat, False)['per_sec']
+            result = results[item.name] = item.measure(repeat, memory)
+            after = reference.measure(repeat, False)['per_sec']
+            # 机器负载的变化同时影响阶段和参照，比值比绝对吞吐稳定
+            result['relative'] = round(result['per_sec'] / ((before + after) / 2), 6) if result['per_sec'] else None
+            print(f'  {item.name:<20} {format_result(result)}')
+    return results
+
+def format_result(result):
+    text = f"{result['seconds']:>9.4f}s {result['per_sec'] or 0:>12,.0f} nodes/s"
+    if result.get('mb_per_sec'):
+        text += f" {result['mb_per_sec']:>8.2f} MB/s"
+    if 'peak_kb' in result:
+        text += f" peak {result['peak_kb'] / 1024:>8.1f} MiB"
+    return text
+
+def compare(results, baseline, tolerance):
+    """
+    逐阶段与基线比较，返回 (报告行, 退步的阶段)。吞吐按与参照阶段的比值比较，
+    比值下降或内存（tracemalloc 统计，与机器无关）上涨超过 tolerance 视为退步。
+    """
+    lines, regressions = [], []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            lines.append(f'  {name:<20} (no baseline)')
+            continue
+        notes = []
+        if base.get('relative') and result.get('relative'):
+            ratio = result['relative'] / base['relative']
+            notes.append(f'throughput {ratio - 1:+.1%}')
+            if ratio < 1 - tolerance: regressions.append(name)
+        if base.get('peak_kb') and result.get('peak_kb') is not None:
+            ratio = result['peak_kb'] / base['peak_kb']
+            notes.append(f'peak memory {ratio - 1:+.1%}')
+            if ratio > 1 + tolerance and name not in regressions: regressions.append(name)
+        marker = ' !' if name in regressions else ''
+        lines.append(f"  {name:<20} {', '.join(notes)}{marker}")
+    return lines, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description='Offline benchmark of the parse / dedupe / merge path on synthetic subscriptions.')
+    parser.add_argument('--nodes', '-n', default='1k,10k', help='Comma separated corpus sizes, e.g. 1k,100k,1m')
+    parser.add_argument('--dup-ratio', '-d', type=float, default=0.3, help='Share of links repeating an earlier node')
+    parser.add_argument('--sources', '-s', type=int, default=8, help='Number of sources the corpus is split into')
+    parser.add_argument('--repeat', '-r', type=int, default=3, help='Timed runs per stage, the fastest is reported')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of delay added to every HTTP response')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc pass for peak memory')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='Baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Store this run as the baseline, as throughput relative to the reference workload')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed relative regression before failing')
+    parser.add_argument('--output', '-o', help='Also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+
+    report, regressions = {}, []
+    for count in map(parse_size, args.nodes.split(',')):
+        key = f'{count}@{args.dup_ratio}'
+        print(f'\n=== {count} nodes, duplicate ratio {args.dup_ratio} ===')
+        report[key] = run_suite(count, args.dup_ratio, args.sources, args.repeat, not args.no_memory, args.latency, args.seed)
+        if key in baseline and not args.save_baseline:
+            print('Against baseline:')
+            lines, failed = compare(report[key], baseline[key], args.tolerance)
+            print('\n'.join(lines))
+            regressions += [f'{key} {name}' for name in failed]
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        baseline.update({key: {name: {field: result.get(field) for field in ('relative', 'peak_kb')} for name, result in stages.items()}
+                         for key, stages in report.items()})
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'\nBaseline written to {args.baseline}.')
+    elif regressions:
+        print(f'\nRegressions beyond {args.tolerance:.0%}: {", ".join(regressions)}')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
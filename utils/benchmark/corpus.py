@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# utils/benchmark/corpus.py 合成订阅语料：五种协议的分享链接、Base64 包装的列表、带规则和策略组的 Clash 配置
+
+import base64, json, random, uuid
+import urllib.parse
+
+from sub_emit import share_link_to_clash, clash_line
+
+PROTOCOLS = ('vmess', 'vless', 'trojan', 'ss', 'hy2')
+# 源的格式轮流使用，三种格式都会出现
+SOURCE_FORMATS = ('links', 'base64', 'yaml', 'base64')
+REGIONS = ('🇭🇰HK', '🇺🇸US', '🇸🇬SG', '🇯🇵JP', '🇩🇪DE', '🏁RELAY', '香港', '美国', '新加坡')
+CIPHERS = ('aes-128-gcm', 'aes-256-gcm', 'chacha20-ietf-poly1305', '2022-blake3-aes-128-gcm')
+
+def _server(rng, index):
+    # 约一半是 IP，一半是域名，和真实订阅接近
+    if rng.random() < 0.5:
+        return f'{rng.randint(1, 223)}.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}'
+    return f'n{index}.{rng.choice(("cdn", "edge", "node", "relay"))}.example{index % 97}.net'
+
+def _remarks(rng, index):
+    return f'{rng.choice(REGIONS)}-{index:06d}'
+
+def make_link(rng, index, protocol):
+    """生成第 index 个节点的分享链接，同一 index 的服务器地址不同于其他 index"""
+    server, port = _server(rng, index), rng.choice((443, 8443, 2053, 80, 8080)) + index % 3
+    remarks = _remarks(rng, index)
+    user = str(uuid.UUID(int=rng.getrandbits(128)))
+    if protocol == 'vmess':
+        network = rng.choice(('tcp', 'ws', 'ws', 'grpc'))
+        config = {'v': '2', 'ps': remarks, 'add': server, 'port': str(port), 'id': user, 'aid': '0',
+                  'scy': 'auto', 'net': network, 'type': 'none', 'host': f'h{index}.example.org' if network == 'ws' else '',
+                  'path': '/ray' if network == 'ws' else '', 'tls': rng.choice(('tls', '')), 'sni': ''}
+        return 'vmess://' + base64.b64encode(json.dumps(config, ensure_ascii=False).encode('utf-8')).decode('ascii')
+    quoted = urllib.parse.quote(remarks)
+    if protocol == 'vless':
+        if rng.random() < 0.5:
+            params = {'type': 'tcp', 'security': 'reality', 'sni': 'www.microsoft.com', 'fp': 'chrome',
+                      'pbk': base64.urlsafe_b64encode(rng.randbytes(32)).decode('ascii').rstrip('='),
+                      'sid': rng.randbytes(4).hex(), 'flow': 'xtls-rprx-vision'}
+        else:
+            params = {'type': 'ws', 'security': 'tls', 'sni': f'h{index}.example.org', 'host': f'h{index}.example.org', 'path': '/vless'}
+        return f'vless://{user}@{server}:{port}?{urllib.parse.urlencode(params)}#{quoted}'
+    if protocol == 'trojan':
+        return f'trojan://{user}@{server}:{port}?sni={server}#{quoted}'
+    if protocol == 'ss':
+        creds = base64.urlsafe_b64encode(f'{rng.choice(CIPHERS)}:{user[:16]}'.encode('ascii')).decode('ascii').rstrip('=')
+        plugin = ''
+        if rng.random() < 0.1:
+            plugin = '?' + urllib.parse.urlencode({'plugin': f'obfs-local;obfs=http;obfs-host=h{index}.example.org'})
+        return f'ss://{creds}@{server}:{port}{plugin}#{quoted}'
+    return f'hysteria2://{user}@{server}:{port}?sni={server}&insecure=1#{quoted}'
+
+def make_links(count, dup_ratio=0.3, seed=1):
+    """
+    生成 count 条链接，其中约 dup_ratio 比例重复之前的节点：
+    一半是完全相同的链接，一半只换了备注（指纹相同，链接不同），都应被去重。
+    """
+    rng = random.Random(seed)
+    links, originals = [], []
+    for _ in range(count):
+        if originals and rng.random() < dup_ratio:
+            link = rng.choice(originals)
+            if rng.random() < 0.5 and not link.startswith('vmess://'):
+                link = link.rpartition('#')[0] + '#' + urllib.parse.quote(_remarks(rng, rng.getrandbits(20)))
+            links.append(link)
+        else:
+            link = make_link(rng, len(originals), PROTOCOLS[len(originals) % len(PROTOCOLS)])
+            originals.append(link)
+            links.append(link)
+    return links
+
+def clash_document(links, rule_count=2000):
+    """以仓库输出的单行 flow 格式写 proxies，再附上策略组和 rule_count 条规则，模拟常见的机场配置"""
+    lines = ['port: 7890', 'socks-port: 7891', 'allow-lan: false', 'mode: rule', 'log-level: info', 'proxies:']
+    names = []
+    for link in links:
+        proxy = share_link_to_clash(link)
+        if proxy:
+            proxy['name'] = f"{proxy['name']} {len(names)}" # Clash 要求名称唯一
+            names.append(proxy['name'])
+            lines.append(clash_line(proxy))
+    lines.append('proxy-groups:')
+    for group, kind in (('Proxy', 'select'), ('Auto', 'url-test'), ('Fallback', 'fallback')):
+        lines.append(f'  - name: {group}')
+        lines.append(f'    type: {kind}')
+        if kind != 'select':
+            lines.append('    url: http://www.gstatic.com/generate_204')
+            lines.append('    interval: 300')
+        lines.append('    proxies:')
+        lines.extend(f'      - {json.dumps(name, ensure_ascii=False)}' for name in names)
+    lines.append('rules:')
+    lines.extend(f'  - DOMAIN-SUFFIX,site{index}.example.com,{("Proxy", "DIRECT", "Auto")[index % 3]}' for index in range(rule_count))
+    lines.append('  - MATCH,Proxy')
+    return '\n'.join(lines) + '\n'
+
+def encode_source(links, fmt):
+    """按格式生成一个源的原始内容 bytes"""
+    if fmt == 'yaml':
+        return clash_document(links).encode('utf-8')
+    text = '\n'.join(links).encode('utf-8')
+    if fmt == 'base64':
+        # 常见订阅把 Base64 按 76 列折行
+        encoded = base64.b64encode(text)
+        return b'\n'.join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+    return text
+
+def build_corpus(count, dup_ratio=0.3, sources=8, seed=1):
+    """
+    生成 count 个节点，按顺序切分到 sources 个源，格式在 SOURCE_FORMATS 中轮换。
+    返回 {'links': 全部链接, 'files': {文件名: bytes}, 'formats': {文件名: 格式}}
+    """
+    links = make_links(count, dup_ratio, seed)
+    sources = max(1, min(sources, count))
+    size = -(-count // sources)
+    files, formats = {}, {}
+    for index in range(sources):
+        fmt = SOURCE_FORMATS[index % len(SOURCE_FORMATS)]
+        name = f'source{index:02d}.{"yaml" if fmt == "yaml" else "txt"}'
+        files[name] = encode_source(links[index * size:(index + 1) * size], fmt)
+        formats[name] = fmt
+    return {'links': links, 'files': files, 'formats': formats}
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# utils/benchmark/server.py 本地 HTTP 订阅源，代替真实网站提供合成语料
+
+import hashlib, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class source_server():
+    """
+    在后台线程中提供 files = {路径: bytes}，支持 ETag 条件请求（返回 304），
+    latency 秒的固定延迟用于模拟慢速源。用法:
+        with source_server(files) as server:
+            server.url('source00.txt')
+    """
+    def __init__(self, files, latency=0.0, host='127.0.0.1', port=0):
+        self.files = {name.lstrip('/'): (body, '"' + hashlib.sha1(body).hexdigest() + '"') for name, body in files.items()}
+        self.latency = latency
+        self.requests = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    def _handler(self):
+        server = self
+
+        class handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                entry = server.files.get(self.path.split('?', 1)[0].lstrip('/'))
+                if entry is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body, etag = entry
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return handler
+
+    def url(self, name):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/{name}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
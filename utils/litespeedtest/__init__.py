@@ -1,3 +1,4 @@
 import litespeedtest.speedtest
 
+speedtest_results = litespeedtest.speedtest.speedtest_results
 speedtest = litespeedtest.speedtest.speedtest
\ No newline at end of file
@@ -1,83 +1,293 @@
-import json, base64, os
-import subprocess, argparse
+import json, base64, os, re, heapq
+import subprocess, argparse, tempfile, threading, time
+
+try:
+    from sub_metrics import metrics # 由 main.py 调用时记录到运行报告
+except ImportError:
+    metrics = None
+
+LITE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXECUTABLE = 'lite-linux-amd64' if os.name == 'posix' else 'lite-windows-amd64.exe'
 
 def speedtest(subscription,output_range,other_config={'concurrency': -1, 'timeout': -1}):
     """Wrapper for litespeedtest.
     configurations:
         subscription: Subcription to speedtest, support local file path or url
         output_range: output proxy list range. Set value to '-1' means output all the prorxies, '99' means output 0 to 99 proxies, '99,999' means output 99 to 999 proxies.
-        concurrency: The number of proxies tested in one time
+        concurrency: The number of proxies tested in one time (by each shard)
         timeout: Time period that cannot connect to the tested proxy
+        early_stop: Stop the test once enough qualifying proxies for output_range have been found
+        min_speed: Average speed (bytes/s) a proxy needs to count as qualifying for early_stop
+        max_ping: Ping (ms) a proxy needs to stay within to count as qualifying for early_stop in pingonly mode, 0 accepts any ping
+        shards: Split a local subscription into this many parts, each tested by its own lite process
     """
     default_config = {
         'subscription': subscription, 'outputRange': output_range, 
-        'concurrency': -1, 'timeout': -1
+        'concurrency': -1, 'timeout': -1, 'early_stop': False, 'min_speed': 0, 'max_ping': 0, 'shards': 1
     }
     default_config.update(other_config)
     config = default_config
-    
-    work_dir = os.getcwd()
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-
-    confighandler(config) # Initialize configurations
-    if os.name == 'posix':
-        args = ['./lite-linux-amd64', '--config', './config.json', '--test', 'Eternity']
-    elif os.name == 'nt':
-        args = ['.\lite-windows-amd64.exe', '--config', './config.json', '--test', 'Eternity']
-    litespeedtest = subprocess.Popen(args,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,universal_newlines=True,encoding='utf-8',bufsize=1)
-
-    # Progress bar
-    max_node = 1
-    current_node = 0
-    for line in iter(litespeedtest.stdout.readline, ''):
-        try:
-            info = json.loads(line[19:])
-            try:
-                if int(info['servers'][len(info['servers'])-1]['id'])+1 > max_node:
-                    max_node = int(info['servers'][len(info['servers'])-1]['id'])+1
-            except Exception:
-                pass            
-            if info['info'] == 'endone':
-                current_node += 1
-        except Exception:
-            pass
-        #print(f'{current_node}/{max_node}', end='\r')
-        progressbar(current_node, max_node, desc='Litespeedtest running progress')
-
-    # Generate proxies list
-    with open('./out.json', 'r', encoding='utf-8') as f:
-        proxies_all = json.load(f)
-    #Remove temp file
-    os.remove('./out.json')
-    os.chdir(work_dir)
-
-    output_list = []
-    output_range = config['outputRange']
+    begin, end = parse_range(config['outputRange'])
+    proxies_all = run_speedtest(config, end)
+
+    output_list = [proxy['Link'] for proxy in proxies_all[begin:end] if proxy.get('Link')]
+    content = base64.b64encode('\n'.join(output_list).encode('utf-8')).decode('ascii')
+    return content
+
+def speedtest_results(subscription,other_config={}):
+    """Test every proxy of subscription and return all usable results (dicts like out.json) ranked best first.
+    Accepts the same other_config keys as speedtest(); early_stop is ignored.
+    """
+    config = {'subscription': subscription, 'outputRange': '-1', 'concurrency': -1, 'timeout': -1, 'shards': 1}
+    config.update(other_config)
+    config.update({'early_stop': False})
+    return run_speedtest(config, None)
+
+def run_speedtest(config, end):
+    """运行全部分片，返回排名前 end 的结果（end 为 None 时返回全部）"""
+    subscription = config['subscription']
+    if '://' not in subscription and not os.path.isabs(subscription):
+        subscription = os.path.join(LITE_DIR, subscription) # 相对路径以本目录为基准
+
+    # 本地订阅文件可以按 id 找回链接，此时关闭 lite 自带的去重让 id 与行号一致
+    links = read_links(subscription)
+    if links:
+        count = max(1, min(int(config['shards']), len(links)))
+        size = -(-len(links) // count)
+        shards = [(links[i:i + size], i) for i in range(0, len(links), size)]
+    else:
+        shards = [(None, 0)]
+
+    results = result_heap(end)
+    stop = threading.Event()
+    rule = stop_rule(config) if config['early_stop'] else None
+    streams = [result_stream(shard, results, rule, offset) for shard, offset in shards]
+    if len(shards) > 1:
+        print(f'Testing {len(links)} proxies in {len(shards)} shards...')
+    # 每个分片在独立的临时目录中运行，配置和 out.json 互不干扰
+    with tempfile.TemporaryDirectory(prefix='litespeedtest-') as temp_dir:
+        threads = []
+        for index, stream in enumerate(streams):
+            shard_dir = os.path.join(temp_dir, str(index))
+            os.makedirs(shard_dir)
+            thread = threading.Thread(target=run_shard, args=(config, subscription, stream, shard_dir, stop, streams))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if stop.is_set():
+            print(f'\nFound {end} qualifying proxies, stopping speedtest early.')
+        proxies_all = results.ranked()
+        if not proxies_all:
+            # 没有解析到结果事件时退回读取 lite 写出的完整结果
+            for index in range(len(streams)):
+                out_file = os.path.join(temp_dir, str(index), 'out.json')
+                if os.path.exists(out_file):
+                    with open(out_file, 'r', encoding='utf-8') as f:
+                        proxies_all += json.load(f)
+            if len(streams) > 1: proxies_all.sort(key=result_heap.rank, reverse=True)
+    return proxies_all
+
+def run_shard(config, subscription, stream, shard_dir, stop, streams):
+    """运行一个 lite 进程并消费它的输出，任一分片凑满结果后所有分片一起停止"""
+    if stream.links is not None:
+        subscription = os.path.join(shard_dir, 'subscription.txt')
+        with open(subscription, 'w', encoding='utf-8') as f:
+            f.write(base64.b64encode('\n'.join(stream.links).encode('utf-8')).decode('ascii'))
+    shard_config = dict(config, subscription=subscription, unique=stream.links is None)
+    config_file = os.path.join(shard_dir, 'config.json')
+    confighandler(shard_config, config_file)
+    args = [os.path.join(LITE_DIR, EXECUTABLE), '--config', config_file, '--test', 'Eternity']
+    start = time.perf_counter()
+    litespeedtest = subprocess.Popen(args,cwd=shard_dir,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,universal_newlines=True,encoding='utf-8',bufsize=1)
+    try:
+        for line in iter(litespeedtest.stdout.readline, ''):
+            if stream.feed(line):
+                stop.set()
+            if stop.is_set():
+                break
+            progressbar(sum(s.finished for s in streams), sum(s.total for s in streams), desc='Litespeedtest running progress')
+    finally:
+        if litespeedtest.poll() is None:
+            litespeedtest.terminate()
+        litespeedtest.wait()
+        if metrics:
+            metrics.source('speedtest', shard=os.path.basename(shard_dir), nodes=stream.total, finished=stream.finished,
+                           seconds=round(time.perf_counter() - start, 3), returncode=litespeedtest.returncode)
+
+def stop_rule(config):
+    """early_stop 的达标条件：pingonly 时 lite 不测速度，改为按延迟判断"""
+    if speedtest_mode() == 'pingonly':
+        return {'max_ping': int(config.get('max_ping', 0))}
+    return {'min_speed': float(config.get('min_speed', 0))}
+
+def parse_ping(record):
+    return int(record['ping']) if str(record['ping']).isdigit() else 0
+
+def parse_range(output_range):
+    """'-1' -> (0, None)，'99' -> (0, 99)，'99,999' -> (99, 999)"""
+    output_range = str(output_range)
     if ',' in output_range:
-        output_range = {'begin': int(output_range.split(',',1)[0]),'end': int(output_range.split(',',1)[1])}
+        begin, end = output_range.split(',', 1)
+        return int(begin), int(end)
     elif output_range == '-1':
-        output_range = {'begin': 0, 'end': len(proxies_all)}
-    else:
-        output_range = {'begin': 0, 'end': int(output_range)}
-    for index in range(output_range['begin'],output_range['end']):
+        return 0, None
+    return 0, int(output_range)
+
+def read_links(subscription):
+    """读取本地的 base64 或明文订阅文件，返回链接列表；链接地址等其他情况返回 None"""
+    if not os.path.isfile(subscription):
+        return None
+    with open(subscription, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+    if '://' not in content:
         try:
-            proxy = proxies_all[index]['Link']
-            output_list.append(proxy)
+            content = base64.b64decode(content + '=' * (-len(content) % 4)).decode('utf-8', 'ignore')
         except Exception:
-            pass
-    content = base64.b64encode('\n'.join(output_list).encode('utf-8')).decode('ascii')
-    return content
+            return None
+    return [line.strip() for line in content.splitlines() if line.strip()]
+
+UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+SIZE = re.compile(r'^\s*([\d.]+)\s*([KMG]?B)', re.I)
+
+def parse_bytes(value):
+    """速度可能是字节数，也可能是 '1.2MB' 这样的字符串"""
+    if isinstance(value, (int, float)):
+        return value
+    match = SIZE.match(str(value or ''))
+    if not match:
+        return 0
+    return float(match.group(1)) * UNITS[match.group(2).upper()]
+
+def parse_event(line):
+    """lite 的每行输出为 '时间 {json}'，非 json 行返回 None"""
+    start = line.find('{')
+    if start < 0:
+        return None
+    try:
+        event = json.loads(line[start:])
+    except ValueError:
+        return None
+    return event if isinstance(event, dict) else None
+
+class result_heap():
+    """只保留排名前 size 的结果：速度高的在前，速度相同时延迟低的在前"""
+    def __init__(self, size=None):
+        self.size = size
+        self.heap = []
+        self.count = 0
+        self.lock = threading.Lock() # 多个分片共用一个堆
+
+    @staticmethod
+    def rank(record):
+        ping = parse_ping(record)
+        return (record['avg_speed'], -ping if ping > 0 else -float('inf'))
+
+    @staticmethod
+    def qualifies(record, rule):
+        """rule 为 {'min_speed': 字节/秒} 或 {'max_ping': 毫秒}（0 表示有延迟即可）"""
+        if 'max_ping' in rule:
+            ping = parse_ping(record)
+            return ping > 0 and (rule['max_ping'] <= 0 or ping <= rule['max_ping'])
+        return record['avg_speed'] >= rule['min_speed']
+
+    def push(self, record, rule=None):
+        """加入一条结果，返回堆是否已满且最差的一条也满足 rule"""
+        with self.lock:
+            self.count += 1
+            # 速度和延迟相同时，按在订阅中的位置排序，分片与否结果一致
+            item = (self.rank(record), -record['id'], -self.count, record)
+            if self.size is None or len(self.heap) < self.size:
+                heapq.heappush(self.heap, item)
+            elif self.size > 0:
+                heapq.heappushpop(self.heap, item)
+            if rule is None or self.size is None or len(self.heap) < self.size:
+                return False
+            return self.qualifies(self.heap[0][-1], rule)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def ranked(self):
+        with self.lock:
+            return [item[-1] for item in sorted(self.heap, reverse=True)]
+
+class result_stream():
+    """
+    逐行消费 lite 的输出事件:
+        gotservers  全部待测节点 (id, remarks, protocol ...)
+        gotping     某个节点的延迟
+        gotspeed    某个节点的平均/最大速度
+        endone      某个节点测试结束
+    结束的可用节点进入有界堆，堆满且最差的一个也满足 early_stop 的达标条件 rule 时 feed 返回 True。
+    """
+    def __init__(self, links=None, results=None, rule=None, offset=0):
+        self.links = links
+        self.offset = offset # 分片第一个节点在整个订阅中的位置
+        self.results = results if results is not None else result_heap()
+        self.rule = rule
+        self.servers = {}
+        self.total = len(links) if links else 1
+        self.finished = 0
+
+    def record(self, server_id):
+        if server_id not in self.servers:
+            self.servers[server_id] = {'id': server_id, 'group': '', 'remarks': '', 'protocol': '', 'ping': '0',
+                                       'avg_speed': 0, 'max_speed': 0, 'isok': False, 'traffic': 0, 'Link': ''}
+        return self.servers[server_id]
+
+    def feed(self, line):
+        event = parse_event(line)
+        if not event:
+            return False
+        info = event.get('info')
+        if info == 'gotservers':
+            for server in event.get('servers') or []:
+                record = self.record(int(server.get('id', 0)))
+                for key in ('group', 'remarks', 'protocol'):
+                    if server.get(key): record[key] = server[key]
+                record['Link'] = server.get('link') or server.get('Link') or record['Link']
+                self.total = max(self.total, record['id'] + 1)
+            return False
+        if 'id' not in event:
+            return False
+        record = self.record(int(event['id']))
+        if info == 'gotping':
+            record['ping'] = str(event.get('ping', '0'))
+        elif info == 'gotspeed':
+            record['avg_speed'] = int(parse_bytes(event.get('speed')))
+            record['max_speed'] = max(record['max_speed'], int(parse_bytes(event.get('maxspeed'))))
+            record['traffic'] = event.get('traffic', record['traffic'])
+        elif info == 'endone':
+            self.finished += 1
+            record = self.servers.pop(record['id'])
+            if not record['Link'] and self.links and record['id'] < len(self.links):
+                record['Link'] = self.links[record['id']]
+            record['id'] += self.offset
+            record['isok'] = record['avg_speed'] > 0 or str(record['ping']) not in ('', '0')
+            if record['isok']:
+                return self.results.push(record, self.rule)
+        return False
+
+    def ranked(self):
+        return self.results.ranked()
+
+def speedtest_mode():
+    """模板 config.json 中的 speedtestMode：pingonly 时结果只有延迟，没有速度"""
+    with open(os.path.join(LITE_DIR, 'config.json'), 'r', encoding='utf-8') as f:
+        return json.load(f).get('speedtestMode', 'all')
 
-def confighandler(input_config):
+def confighandler(input_config, config_file):
     """Config handler for litespeedtest config
     target handling config parameters:
         subscription: Subcription to speedtest, support local file path or url
         outputRange: output proxy list range. Set value to '-1' means output all the prorxies, '99' means output 0 to 99 proxies, '99,999' means output 99 to 999 proxies.
         concurrency: The number of proxies tested in one time
         timeout: Time period that cannot connect to the tested proxy
-    function input_config variant should be a dictionary which has keys and values of above parameters
+    function input_config variant should be a dictionary which has keys and values of above parameters.
+    The template config.json in this directory is left untouched, the result is written to config_file.
     """
-    with open('./config.json', 'r', encoding='utf-8') as f:
+    with open(os.path.join(LITE_DIR, 'config.json'), 'r', encoding='utf-8') as f:
         lite_config = json.load(f)
 
     lite_config['subscription'] = input_config['subscription']
@@ -86,8 +296,10 @@ def confighandler(input_config):
         lite_config['concurrency'] = input_config['concurrency']
     if input_config['timeout'] != -1:
         lite_config['timeout'] = input_config['timeout']
+    if 'unique' in input_config:
+        lite_config['unique'] = input_config['unique']
 
-    with open('./config.json', 'w', encoding='utf-8') as f:
+    with open(config_file, 'w', encoding='utf-8') as f:
         f.write(json.dumps(lite_config, sort_keys=False, indent=4, ensure_ascii=False))
 
 def progressbar(current,range,desc,size=60):
@@ -112,9 +324,6 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     # Write content to file(relative path to script directory)
-    work_dir = os.getcwd()
     output = speedtest(args.subscription,str(args.range))
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    with open(args.path, 'w', encoding='utf-8') as f:
+    with open(os.path.join(LITE_DIR, args.path), 'w', encoding='utf-8') as f:
         f.write(output)
-    os.chdir(work_dir)
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
-import os, urllib
+import os, base64, time
 import configparser
+import requests
 import sys
 
 # --- 动态计算绝对路径 ---
@@ -18,16 +19,33 @@ sys.path.insert(0, PROJECT_ROOT)
 # 导入我们自己的模块
 from sub_merge import merge
 from sub_update import update
+from sub_emit import build_entries, write_lines, write_base64
+from sub_probe import reachable_links
+from sub_sniff import sniff_content, iter_share_links
+from sub_health import health_db
+from sub_geo import download_mmdb, geo_lookup, write_providers, maxminddb
+from sub_dns import dns_cache
+from sub_metrics import metrics
+from sub_replay import open_archive
+from sub_history import add_day
+from sub_score import source_scores
+from litespeedtest import speedtest, speedtest_results
+from litespeedtest.speedtest import parse_range, speedtest_mode
 
 # 使用绝对路径来读取配置文件
 config_file = os.path.join(UTILS_DIR, 'config.ini')
+# 环境变量 SUB_CONFIG 指定的文件在 config.ini 之后读取，其中的值覆盖 config.ini；
+# config.ini 中新增的阶段默认关闭，工作流用 config.workflow.ini 启用
+override_file = os.environ.get('SUB_CONFIG')
+if override_file and not os.path.isabs(override_file):
+    override_file = os.path.join(UTILS_DIR, override_file)
 
 def configparse(section):
     """
     读取指定 section 的配置，并返回一个 configparser 的 SectionProxy 对象。
     """
     config = configparser.ConfigParser()
-    config.read(config_file, encoding='utf-8')
+    config.read([config_file] + ([override_file] if override_file else []), encoding='utf-8')
     # 检查 section 是否存在，避免 KeyErorr
     if section in config:
         return config[section]
@@ -50,33 +68,168 @@ def get_file_dir_config(config_section):
     return file_dir
 
 
-if __name__ == '__main__':
+def speedtest_main(file_dir, speedtest_config):
+    """预筛 → （按健康库挑选需要重测的节点）→ lite 测速 → 写出 share_file 和 share_file_clash"""
+    subscription = speedtest_config.get('subscription', './sub/sub_merge_base64.txt')
+    if subscription.startswith('./'):
+        subscription = os.path.join(PROJECT_ROOT, subscription[2:])
+    source_file = subscription
+    work_dir = file_dir['cache_dir'] if file_dir.get('cache_dir') else UTILS_DIR
+    os.makedirs(work_dir, exist_ok=True)
+    # shards 个 lite 进程并行测试，concurrency 为每个进程的并发数
+    test_config = {
+        'concurrency': speedtest_config.getint('concurrency', fallback=-1),
+        'timeout': speedtest_config.getint('timeout', fallback=-1),
+        'shards': speedtest_config.getint('shards', fallback=1),
+        'early_stop': speedtest_config.getboolean('early_stop', fallback=False),
+        'min_speed': speedtest_config.getint('min_speed', fallback=0),
+        'max_ping': speedtest_config.getint('max_ping', fallback=0)
+    }
+    output_range = speedtest_config.get('output_range', '-1')
+    use_prefilter = speedtest_config.getboolean('prefilter', fallback=False)
+    use_health = speedtest_config.getboolean('health_db', fallback=False)
+
+    if (use_prefilter or use_health) and os.path.isfile(subscription):
+        with open(subscription, 'rb') as f:
+            links = list(iter_share_links(sniff_content(f.read())[1]))
+        if use_prefilter:
+            # 先用 TCP/TLS 连接筛掉不可达的节点，只把可达的交给 lite 测速
+            with metrics.stage('speedtest.prefilter'):
+                metrics.count('speedtest.prefilter_input', len(links))
+                links = reachable_links(links, {
+                    'concurrency': speedtest_config.get('prefilter_concurrency'),
+                    'timeout': speedtest_config.get('prefilter_timeout'),
+                    'tls': speedtest_config.get('prefilter_tls')
+                })
+                metrics.count('speedtest.prefilter_kept', len(links))
+            print(f'Reachability pre-filter kept {len(links)} proxies.')
+        subscription = os.path.join(work_dir, 'speedtest_input.txt')
+        if use_health:
+            begin, end = parse_range(output_range)
+            with health_db(os.path.join(work_dir, 'node_health.db'),
+                           ttl=speedtest_config.getint('health_ttl', fallback=86400),
+                           margin=speedtest_config.getfloat('health_margin', fallback=0.2),
+                           ping_only=speedtest_mode() == 'pingonly') as db:
+                # 只重测新节点、结果过期的节点和入选线附近的节点，其余沿用库中的成绩
+                to_test = db.plan(links, end)
+                print(f'Health database: re-testing {len(to_test)} of {len(links)} proxies.')
+                metrics.count('speedtest.retested', len(to_test))
+                if to_test:
+                    write_base64(subscription, to_test)
+                    with metrics.stage('speedtest.run'):
+                        db.record(to_test, speedtest_results(subscription, test_config))
+                ranked = db.ranked(links)
+            content = base64.b64encode('\n'.join(ranked[begin:end]).encode('utf-8')).decode('ascii')
+        else:
+            write_base64(subscription, links)
+            with metrics.stage('speedtest.run'):
+                content = speedtest(subscription, output_range, test_config)
+    else:
+        with metrics.stage('speedtest.run'):
+            content = speedtest(subscription, output_range, test_config)
+
+    with open(file_dir['share_file'], 'w', encoding='utf-8') as f:
+        f.write(content)
+    links = base64.b64decode(content).decode('utf-8').splitlines()
+    write_lines(file_dir['share_file_clash'], ['proxies:'] + [line for _, _, line in build_entries(links) if line])
+    print(f'Speedtest complete. {len(links)} proxies written to {file_dir["share_file"]}.')
+
+    # 把通过测速的比例记到提供这些节点的订阅源上，供下次排定下载顺序
+    stats_file = os.path.join(work_dir, 'source_stats.json')
+    if os.path.exists(stats_file) and os.path.isfile(source_file):
+        with open(source_file, 'rb') as f:
+            tested = list(iter_share_links(sniff_content(f.read())[1]))
+        scores = source_scores(stats_file)
+        scores.record_speedtest(tested, links)
+        scores.save()
+
+
+def geo_main(file_dir, source_file, archive=None):
+    """条件更新 Country.mmdb，再按国家重命名 source_file 中的节点并写出各地区的 provider"""
+    mmdb_file = file_dir.get('mmdb_file') or os.path.join(UTILS_DIR, 'Country.mmdb')
+    os.makedirs(os.path.dirname(mmdb_file), exist_ok=True)
     try:
         print('Downloading Country.mmdb...')
-        country_mmdb_path = os.path.join(UTILS_DIR, 'Country.mmdb')
-        urllib.request.urlretrieve('https://raw.githubusercontent.com/Loyalsoldier/geoip/release/Country.mmdb', country_mmdb_path)
-        print('Success!\n')
+        session = archive.mount(requests.Session()) if archive else requests
+        changed = download_mmdb(mmdb_file, session=session)
+        print('Success!\n' if changed else 'Not modified, using the local copy.\n')
     except Exception as e:
         print(f'Failed to download Country.mmdb: {e}\n')
-        pass
+    if not os.path.exists(mmdb_file) or maxminddb is None:
+        print('Country.mmdb or maxminddb is unavailable, skipping geo split.')
+        return
+    with open(source_file, 'rb') as f:
+        links = list(iter_share_links(sniff_content(f.read())[1]))
+    cache_file = os.path.join(file_dir['cache_dir'], 'dns_cache.json') if file_dir.get('cache_dir') else None
+    resolver = dns_cache(cache_file, dict(configparse('dns')))
+    geo = geo_lookup(mmdb_file, resolver=resolver)
+    try:
+        counts = write_providers(file_dir['provider_dir'], links, geo)
+    finally:
+        geo.close()
+        resolver.save()
+    print('Geo split complete. ' + ', '.join(f'{region}: {count}' for region, count in counts.items()))
 
+
+if __name__ == '__main__':
     # 一次性读取所有需要的配置 sections
     common_config = configparse('common')
     subconverter_config = configparse('subconverter')
+    fetch_config = configparse('fetch')
+    # profile=cprofile / tracemalloc 时对整个运行做分析，结果写入运行报告
+    metrics.start_profile(common_config.get('profile'))
+    # [fetch] mode=record / replay 时录制或回放本次运行的所有下载
+    archive = open_archive(get_file_dir_config(fetch_config))
 
     # 使用 getboolean 方法，并提供 fallback 默认值
     if common_config.getboolean('update_enabled', fallback=False):
         print('--- Running Subscription Update ---')
         # 传递修复了路径的配置字典
-        update(get_file_dir_config(common_config))
+        with metrics.stage('update'):
+            update(get_file_dir_config(common_config), archive)
 
     if common_config.getboolean('merge_enabled', fallback=False):
         print('--- Running Subscription Merge ---')
         # 准备好传给 merge 类的参数
         file_dir = get_file_dir_config(common_config)
         format_config = dict(subconverter_config)
-        merge(file_dir, format_config)
+        with metrics.stage('merge'):
+            merge(file_dir, format_config, dict(fetch_config), dict(configparse('dns')), archive)
+
+    if common_config.getboolean('speedtest_enabled', fallback=False):
+        print('--- Running Speedtest ---')
+        with metrics.stage('speedtest'):
+            speedtest_main(get_file_dir_config(common_config), configparse('speedtest'))
+
+    file_dir = get_file_dir_config(common_config)
+    # 有测速结果时只拆分、存档测速后的节点，否则使用按备注规则过滤后的合并节点
+    if common_config.getboolean('speedtest_enabled', fallback=False):
+        result_file = file_dir['share_file']
+    else:
+        result_file = os.path.join(file_dir['merge_dir'], 'sub_merge_filtered.txt')
+
+    if common_config.getboolean('geo_enabled', fallback=False):
+        print('--- Running Geo Split ---')
+        with metrics.stage('geo'):
+            geo_main(file_dir, result_file, archive)
+
+    if common_config.get('history_dir') and os.path.exists(result_file):
+        # 与原来 update/ 下的每日快照一样存档测速后的节点（未测速时为过滤后的节点），同一天多次运行时以最后一次为准
+        with metrics.stage('history'), open(result_file, 'rb') as f:
+            day = time.strftime('%y%m%d')
+            node_count, merged = add_day(file_dir['history_dir'], day, '\n'.join(iter_share_links(sniff_content(f.read())[1])))
+        print(f'History archive updated with {day}: {node_count} nodes.' + (f' Merged {", ".join(merged)} into monthly segments.' if merged else ''))
+
+    if archive:
+        archive.close()
 
-    # --- 所有与测速相关的代码已被完全删除 ---
+    if common_config.get('report_file'):
+        report_file = get_file_dir_config(common_config)['report_file']
+        report = metrics.write(report_file)
+        print(f'Run report written to {report_file}.')
+        if common_config.get('report_history'):
+            # 报告每次覆盖，摘要按运行追加，保留最近 report_keep 次
+            history_file = get_file_dir_config(common_config)['report_history']
+            metrics.append_history(report, history_file, common_config.getint('report_keep', fallback=200))
 
     print("\nAll tasks completed.")
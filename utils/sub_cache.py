@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# utils/sub_cache.py 订阅源的本地条件请求缓存（ETag / Last-Modified / 内容哈希）
+
+import json, os, hashlib, time
+
+class http_cache():
+    """
+    目录结构:
+        index.json          { url: {'etag', 'last_modified', 'hash', 'updated'} }
+        <key>.body          上次下载的原始内容
+        <key>.nodes.json    {'hash': 内容哈希, 'nodes': [解析出的节点链接]}
+    key 为 url 的 sha1 前 16 位。
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_file = os.path.join(cache_dir, 'index.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except Exception:
+            self.index = {}
+        self.touched = set() # 本次运行中用到的 url，保存时清理其余的
+
+    def _path(self, url, suffix):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def conditional_headers(self, url):
+        """为条件请求生成 If-None-Match / If-Modified-Since 请求头"""
+        entry = self.index.get(url)
+        if not entry or not os.path.exists(self._path(url, '.body')):
+            return {}
+        headers = {}
+        if entry.get('etag'): headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'): headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def resolve(self, result):
+        """
+        处理一次下载结果：304 时从缓存取回内容，200 时更新缓存。
+        为结果补充 'hash' 和 'unchanged'（内容与上次相同）两个字段。
+        """
+        url = result['item']['url']
+        entry = self.index.get(url, {})
+        self.touched.add(url)
+        result['hash'], result['unchanged'] = None, False
+        if result['error']:
+            return result
+        if result['status'] == 304:
+            try:
+                with open(self._path(url, '.body'), 'rb') as f:
+                    result['body'] = f.read()
+            except Exception as e:
+                result['error'] = f'Cached body unavailable: {e}'
+                return result
+            result['hash'], result['unchanged'] = entry.get('hash'), True
+            return result
+
+        content_hash = hashlib.sha256(result['body']).hexdigest()
+        result['hash'] = content_hash
+        result['unchanged'] = content_hash == entry.get('hash')
+        if not result['unchanged']:
+            with open(self._path(url, '.body'), 'wb') as f:
+                f.write(result['body'])
+        headers = result.get('headers', {})
+        self.index[url] = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'hash': content_hash,
+            'updated': int(time.time())
+        }
+        return result
+
+    def load_nodes(self, url, content_hash):
+        """返回与 content_hash 对应的已解析节点列表，没有则返回 None"""
+        if not content_hash:
+            return None
+        try:
+            with open(self._path(url, '.nodes.json'), 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except Exception:
+            return None
+        return cached['nodes'] if cached.get('hash') == content_hash else None
+
+    def save_nodes(self, url, content_hash, nodes):
+        if not content_hash:
+            return
+        with open(self._path(url, '.nodes.json'), 'w', encoding='utf-8') as f:
+            json.dump({'hash': content_hash, 'nodes': nodes}, f, ensure_ascii=False)
+
+    def save(self):
+        """写回索引，并删除本次运行没有用到的源的缓存文件"""
+        for url in list(self.index):
+            if url in self.touched:
+                continue
+            for suffix in ('.body', '.nodes.json'):
+                path = self._path(url, suffix)
+                if os.path.exists(path): os.remove(path)
+            del self.index[url]
+        with open(self.index_file, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, indent=2, ensure_ascii=False)
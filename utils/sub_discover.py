@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# utils/sub_discover.py 声明式的订阅链接查找规则
+"""
+sub_list.json 中 update_method 不为 auto 的源通过 "discover" 字段声明查找方式:
+
+    date_template   按日期拼出链接
+        {"strategy": "date_template", "template": "https://example.com/{date:%Y%m%d}.txt", "days": 2, "probe": true}
+    github_contents 列出 GitHub 仓库目录，按文件名筛选、排序后取第一个
+        {"strategy": "github_contents", "api": "https://api.github.com/repos/<owner>/<repo>/contents/",
+         "name_pattern": "^v", "sort": "name", "reverse": true}
+    page_regex      下载页面，用正则找出链接，可用 follow 再跟进一层页面（follow 的 page 中 {match} 为上一层的结果）
+        {"strategy": "page_regex", "page": "https://example.com/{date:%Y%m%d}.html", "pattern": "https://\\S+?\\.txt",
+         "group": 0, "days": 2, "probe": true, "max_bytes": 1048576, "soup": false, "follow": {...}}
+        页面按块流式读取，找到匹配或读满 max_bytes 后立即断开连接；
+        soup 为 true 时，流式查找失败后再用 BeautifulSoup 提取页面文字查找一次（链接被标签拆开时使用）。
+
+模板中的 {date:格式} 按 strftime 格式化，{date.month}、{date.day} 为不补零的月、日。
+days 为回溯天数（今天、昨天……），probe 为 true 时只接受能访问的链接。
+同一规则的所有候选链接并发探测，按日期优先顺序取第一个成功的。
+"""
+
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import re
+
+DATE_FIELD = re.compile(r'\{date(?::([^}]*)|\.(\w+))\}')
+
+def render(template, date, escape=False, match=None):
+    """替换模板中的日期字段；escape 为 True 时用于正则，对替换值转义"""
+    def replace(field):
+        value = date.strftime(field.group(1)) if field.group(1) is not None else str(getattr(date, field.group(2)))
+        return re.escape(value) if escape else value
+    text = DATE_FIELD.sub(replace, template)
+    if match is not None:
+        text = text.replace('{match}', match)
+    return text
+
+@lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    """同一规则同一天的正则只编译一次，pattern 为 bytes 时用于直接匹配原始响应"""
+    return re.compile(pattern)
+
+def candidate_dates(rule):
+    today = datetime.today()
+    return [today - timedelta(days=delta) for delta in range(int(rule.get('days', 1)))]
+
+def probe(session, url, timeout=5):
+    """判断远程链接是否可用，只读取响应头"""
+    try:
+        with session.get(url, timeout=timeout, stream=True) as resp:
+            return resp.status_code == 200
+    except Exception:
+        return False
+
+def first_success(candidates, check):
+    """并发检查所有候选，按候选顺序返回第一个通过检查的结果"""
+    if not candidates:
+        return None
+    executor = ThreadPoolExecutor(max_workers=len(candidates))
+    futures = [executor.submit(check, candidate) for candidate in candidates]
+    try:
+        for future in futures:
+            try:
+                result = future.result()
+            except Exception:
+                continue
+            if result:
+                return result
+        return None
+    finally:
+        # 找到结果后不再等待其余候选
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def discover_date_template(rule, session):
+    urls = [render(rule['template'], date) for date in candidate_dates(rule)]
+    if not rule.get('probe', True):
+        return urls[0]
+    return first_success(urls, lambda url: url if probe(session, url) else None)
+
+def discover_github_contents(rule, session):
+    resp = session.get(rule['api'], timeout=10)
+    if resp.status_code != 200:
+        return None
+    name_pattern = compile_pattern(rule.get('name_pattern', ''))
+    files = [f for f in resp.json() if name_pattern.search(f['name'])]
+    if rule.get('sort'):
+        files.sort(key=lambda f: f[rule['sort']], reverse=rule.get('reverse', True))
+    return files[0][rule.get('field', 'download_url')] if files else None
+
+def scan_stream(resp, pattern, max_bytes=1048576, overlap=4096, chunk_size=16384):
+    """
+    分块读取响应并查找 pattern（bytes 正则），只保留 overlap 字节的尾部用于跨块匹配。
+    匹配必须在缓冲区末尾之前结束，否则可能是被截断的半个链接，要等下一块数据再判断。
+    返回匹配对象，读完或读满 max_bytes 仍未找到时返回 None。
+    """
+    buffer = b''
+    read = 0
+    for chunk in resp.iter_content(chunk_size=chunk_size):
+        buffer += chunk
+        read += len(chunk)
+        keep_from = len(buffer) - overlap
+        match = pattern.search(buffer)
+        if match:
+            if match.end() < len(buffer):
+                return match
+            keep_from = min(keep_from, match.start()) # 保留可能未读完的匹配
+        if read >= max_bytes:
+            return None
+        buffer = buffer[max(keep_from, 0):]
+    # 数据读完，缓冲区末尾的匹配也是完整的
+    return pattern.search(buffer)
+
+def search_soup(rule, session, page_url, pattern):
+    """兜底：下载整页，用 BeautifulSoup 提取文字后查找"""
+    from bs4 import BeautifulSoup
+    resp = session.get(page_url, timeout=10)
+    if resp.status_code != 200:
+        return None
+    soup = BeautifulSoup(resp.content, 'html.parser')
+    text = '\n'.join(soup.stripped_strings)
+    match = compile_pattern(pattern.pattern.decode('utf-8')).search(text)
+    return match.group(rule.get('group', 0)) if match else None
+
+def search_page(rule, session, page_url, pattern):
+    with session.get(page_url, timeout=10, stream=True) as resp:
+        if resp.status_code != 200:
+            return None
+        match = scan_stream(resp, pattern, int(rule.get('max_bytes', 1048576)))
+    if match:
+        return match.group(rule.get('group', 0)).decode('utf-8', 'ignore')
+    if rule.get('soup'):
+        return search_soup(rule, session, page_url, pattern)
+    return None
+
+def discover_page_regex(rule, session, match=None):
+    def check(date):
+        page_url = render(rule['page'], date, match=match)
+        pattern = compile_pattern(render(rule['pattern'], date, escape=True).encode('utf-8'))
+        found = search_page(rule, session, page_url, pattern)
+        if found and rule.get('follow'):
+            found = discover_page_regex(rule['follow'], session, match=found)
+        if found and rule.get('probe', True) and not probe(session, found):
+            return None
+        return found
+    dates = candidate_dates(rule) if match is None else [datetime.today()]
+    return first_success(dates, check)
+
+STRATEGIES = {
+    'date_template': discover_date_template,
+    'github_contents': discover_github_contents,
+    'page_regex': discover_page_regex
+}
+
+def discover(rule, session):
+    """按规则查找最新链接，找不到时返回 None"""
+    strategy = STRATEGIES.get(rule.get('strategy'))
+    if strategy is None:
+        raise ValueError(f"Unknown discover strategy: {rule.get('strategy')}")
+    return strategy(rule, session)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# utils/sub_dns.py 批量异步域名解析，结果带 TTL 保存在缓存目录中供下次运行使用
+
+import asyncio, json, os, time, socket, ipaddress
+
+try:
+    import aiodns # 可选，有时直接查询 A 记录并使用记录自身的 TTL
+except ImportError:
+    aiodns = None
+
+DEFAULT_DNS_CONFIG = {'concurrency': 64, 'timeout': 5, 'ttl': 21600, 'negative_ttl': 1800}
+
+def is_ip(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+class dns_cache():
+    """
+    cache_file 内容为 { 域名: [IP 或 null, 过期时间戳] }，解析失败的结果也缓存 negative_ttl 秒。
+    resolve_all 只解析缓存中没有或已过期的域名，最多 concurrency 个同时进行。
+    """
+    def __init__(self, cache_file=None, dns_config={}):
+        settings = dict(DEFAULT_DNS_CONFIG)
+        settings.update({key: value for key, value in dns_config.items() if value not in (None, '')})
+        self.concurrency = int(settings['concurrency'])
+        self.timeout = float(settings['timeout'])
+        self.ttl = int(settings['ttl'])
+        self.negative_ttl = int(settings['negative_ttl'])
+        self.cache_file = cache_file
+        self.entries = {}
+        if cache_file:
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except Exception:
+                self.entries = {}
+
+    def save(self):
+        if not self.cache_file:
+            return
+        now = time.time()
+        entries = {host: entry for host, entry in self.entries.items() if entry[1] > now}
+        temp_file = self.cache_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(temp_file, self.cache_file)
+
+    async def _lookup(self, resolver, host):
+        """返回 (IP, ttl)，失败时 IP 为 None"""
+        try:
+            if resolver:
+                records = await asyncio.wait_for(resolver.query(host, 'A'), self.timeout)
+                if records:
+                    return records[0].host, max(int(records[0].ttl), 60)
+                return None, self.negative_ttl
+            loop = asyncio.get_running_loop()
+            infos = await asyncio.wait_for(loop.getaddrinfo(host, None, proto=socket.IPPROTO_TCP), self.timeout)
+            return infos[0][4][0], self.ttl
+        except Exception:
+            return None, self.negative_ttl
+
+    async def _resolve(self, hosts):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        resolver = aiodns.DNSResolver() if aiodns else None
+
+        async def bounded(host):
+            async with semaphore:
+                return host, await self._lookup(resolver, host)
+
+        return await asyncio.gather(*(bounded(host) for host in hosts))
+
+    def resolve_all(self, hosts):
+        """返回 { host: IP 或 None }；IP 地址原样返回，不发起查询"""
+        now = time.time()
+        result, pending = {}, []
+        for host in set(hosts):
+            if is_ip(host):
+                result[host] = host
+            elif host in self.entries and self.entries[host][1] > now:
+                result[host] = self.entries[host][0]
+            else:
+                pending.append(host)
+        if pending:
+            for host, (ip, ttl) in asyncio.run(self._resolve(pending)):
+                self.entries[host] = [ip, now + ttl]
+                result[host] = ip
+        return result
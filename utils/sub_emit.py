@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# utils/sub_emit.py 由去重后的节点一次生成所有输出格式，不再经过外部 subconverter
+
+import base64, json, os, re
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+
+from sub_node import base64_decode
+
+YAML_DUMPER = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+CLASH_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'subconverter', 'base', 'GeneralClashConfig.yml')
+# 模板中旧格式的占位段，输出时替换为 proxies / proxy-groups / rules
+LEGACY_SECTIONS = re.compile(r'^(Proxy|Proxy Group|Rule):\n(?:[ \t].*\n|\n)*', re.M)
+# libyaml 会把 emoji 等 BMP 以外的字符写成 \UXXXXXXXX，还原成原字符，与原来的输出保持一致
+DOUBLE_QUOTED = re.compile(r'"(?:[^"\\]|\\.)*"')
+ASTRAL_ESCAPE = re.compile(r'(?<!\\)((?:\\\\)*)\\U([0-9A-Fa-f]{8})')
+
+def write_base64(path, lines, chunk_size=3 * 16384):
+    """
+    将 lines 以换行连接后的 Base64 编码分块写入 path，结果与一次性 base64_encode 完全相同，
+    但不需要同时持有整段明文和它的 Base64 副本。chunk_size 必须是 3 的倍数。
+    """
+    buffer = bytearray()
+    with open(path, 'w', encoding='utf-8') as file:
+        for index, line in enumerate(lines):
+            if index: buffer += b'\n'
+            buffer += line.encode('utf-8')
+            if len(buffer) >= chunk_size:
+                cut = len(buffer) - len(buffer) % 3
+                file.write(base64.b64encode(bytes(buffer[:cut])).decode('ascii'))
+                del buffer[:cut]
+        file.write(base64.b64encode(bytes(buffer)).decode('ascii'))
+
+def _split_address(address):
+    server, port = address.rsplit(':', 1)
+    return server.strip('[]'), int(port)
+
+def _query(query):
+    return {key: values[0] for key, values in urllib.parse.parse_qs(query).items()}
+
+def _transport(proxy, network, host, path):
+    proxy['network'] = network
+    if network == 'ws':
+        ws_opts = {'path': path or '/'}
+        if host: ws_opts['headers'] = {'Host': host}
+        proxy['ws-opts'] = ws_opts
+    elif network == 'grpc' and path:
+        proxy['grpc-opts'] = {'grpc-service-name': path}
+
+def share_link_to_clash(link):
+    """clash_to_share_link 的逆操作：把分享链接转换为 Clash 代理字典，不支持时返回 None"""
+    try:
+        protocol, rest = link.split('://', 1)
+        rest, _, remarks = rest.partition('#')
+        name = urllib.parse.unquote(remarks)
+        if protocol == 'vmess':
+            config = json.loads(base64_decode(rest))
+            proxy = {
+                'name': config.get('ps') or name, 'server': config['add'], 'port': int(config['port']),
+                'type': 'vmess', 'uuid': config['id'], 'alterId': int(config.get('aid') or 0),
+                'cipher': config.get('scy') or 'auto', 'tls': config.get('tls') == 'tls'
+            }
+            _transport(proxy, config.get('net') or 'tcp', config.get('host'), config.get('path'))
+            if proxy['tls'] and config.get('sni'): proxy['servername'] = config['sni']
+            return proxy
+        userinfo, _, address = rest.partition('@')
+        address, _, query = address.partition('?')
+        server, port = _split_address(address.rstrip('/'))
+        params = _query(query)
+        userinfo = urllib.parse.unquote(userinfo)
+        if protocol == 'vless':
+            proxy = {'name': name, 'server': server, 'port': port, 'type': 'vless', 'uuid': userinfo}
+            security = params.get('security', 'none')
+            proxy['tls'] = security in ('tls', 'reality')
+            if params.get('sni'): proxy['servername'] = params['sni']
+            if params.get('flow'): proxy['flow'] = params['flow']
+            if params.get('fp'): proxy['client-fingerprint'] = params['fp']
+            if security == 'reality':
+                proxy['reality-opts'] = {'public-key': params.get('pbk', ''), 'short-id': params.get('sid', '')}
+            _transport(proxy, params.get('type', 'tcp'), params.get('host'), params.get('path') or params.get('serviceName'))
+            return proxy
+        elif protocol == 'trojan':
+            proxy = {'name': name, 'server': server, 'port': port, 'type': 'trojan', 'password': userinfo}
+            if params.get('sni'): proxy['sni'] = params['sni']
+            proxy['skip-cert-verify'] = params.get('allowInsecure') == '1'
+            if params.get('type', 'tcp') != 'tcp':
+                _transport(proxy, params['type'], params.get('host'), params.get('path') or params.get('serviceName'))
+            return proxy
+        elif protocol == 'ss':
+            # SIP002: userinfo 为 base64(method:password)，少数为未编码的 method:password
+            creds = userinfo if ':' in userinfo else base64_decode(userinfo.replace('-', '+').replace('_', '/'))
+            cipher, password = creds.split(':', 1)
+            proxy = {'name': name, 'server': server, 'port': port, 'type': 'ss', 'cipher': cipher, 'password': password}
+            if params.get('plugin'):
+                plugin, *options = params['plugin'].split(';')
+                options = dict(option.partition('=')[::2] for option in options)
+                if plugin in ('obfs-local', 'simple-obfs'):
+                    proxy['plugin'] = 'obfs'
+                    proxy['plugin-opts'] = {'mode': options.get('obfs', 'http'), 'host': options.get('obfs-host', '')}
+                elif plugin == 'v2ray-plugin':
+                    proxy['plugin'] = 'v2ray-plugin'
+                    proxy['plugin-opts'] = {'mode': options.get('mode', 'websocket'), 'tls': 'tls' in options,
+                                            'host': options.get('host', ''), 'path': options.get('path', '/')}
+                else:
+                    return None # Clash 不支持的插件
+            return proxy
+        elif protocol in ('hysteria2', 'hy2'):
+            proxy = {'name': name, 'server': server, 'port': port, 'type': 'hysteria2', 'password': userinfo}
+            if params.get('sni'): proxy['sni'] = params['sni']
+            if params.get('insecure') == '1': proxy['skip-cert-verify'] = True
+            if params.get('obfs'): proxy['obfs'] = params['obfs']
+            if params.get('obfs-password'): proxy['obfs-password'] = params['obfs-password']
+            return proxy
+        return None
+    except Exception:
+        return None
+
+def clash_line(proxy):
+    """单行 flow 风格，与仓库中 sub_merge_clash.yaml 的格式一致"""
+    text = yaml.dump(proxy, Dumper=YAML_DUMPER, default_flow_style=True, allow_unicode=True, sort_keys=False, width=1 << 30)
+    if '\\U' in text:
+        text = DOUBLE_QUOTED.sub(lambda q: ASTRAL_ESCAPE.sub(lambda m: m.group(1) + chr(int(m.group(2), 16)), q.group()), text)
+    return f'  - {text.strip()}'
+
+def build_entries(links):
+    """单次遍历：为每条链接生成唯一名称的 Clash 条目，无法转换的链接对应 None"""
+    used_names = {}
+    entries = []
+    for link in links:
+        proxy = share_link_to_clash(link)
+        if proxy:
+            name = proxy['name'] or f"{proxy['server']}:{proxy['port']}"
+            count = used_names.get(name, 0) + 1
+            used_names[name] = count
+            # Clash 要求名称唯一，重名的依次加上序号
+            proxy['name'] = name if count == 1 else f'{name} {count}'
+            entries.append((link, proxy['name'], clash_line(proxy)))
+        else:
+            entries.append((link, None, None))
+    return entries
+
+def write_lines(path, lines):
+    with open(path, 'w', encoding='utf-8') as file:
+        for index, line in enumerate(lines):
+            if index: file.write('\n')
+            file.write(line)
+
+def write_clash_config(path, entries, template=CLASH_TEMPLATE):
+    """以 GeneralClashConfig.yml 为基础生成完整的 Clash 配置"""
+    with open(template, 'r', encoding='utf-8') as f:
+        base = LEGACY_SECTIONS.sub('', f.read())
+    names = [name for _, name, line in entries if line]
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(base.rstrip('\n') + '\n\nproxies:\n')
+        for _, _, line in entries:
+            if line: file.write(line + '\n')
+        group = {'name': 'Proxy', 'type': 'select', 'proxies': names + ['DIRECT']}
+        file.write('\nproxy-groups:\n')
+        file.write(yaml.dump([group], Dumper=YAML_DUMPER, allow_unicode=True, sort_keys=False, indent=2))
+        file.write('\nrules:\n  - MATCH,Proxy\n')
+
+def emit_outputs(merge_dir, links, clash_config_file=None):
+    """
+    links 为排序后的去重链接，并行写出:
+        sub_merge.txt           明文分享链接
+        sub_merge_base64.txt    Base64 订阅
+        sub_merge_clash.yaml    Clash proxies 列表
+        sub_merge_clash.txt     能转换为 Clash 的节点的分享链接（明文），与 sub_merge_clash.yaml 一一对应
+        sub_merge_filtered.txt  按 [subconverter] include_remarks / exclude_remarks 过滤后的节点（明文），
+                                与原来的含义相同；过滤已在合并时完成，所以内容即 links
+        clash_config_file       可选，基于模板的完整 Clash 配置
+    """
+    entries = build_entries(links)
+    clash_entries = [entry for entry in entries if entry[2]]
+    jobs = [
+        (write_lines, os.path.join(merge_dir, 'sub_merge.txt'), links),
+        (write_base64, os.path.join(merge_dir, 'sub_merge_base64.txt'), links),
+        (write_lines, os.path.join(merge_dir, 'sub_merge_clash.yaml'), ['proxies:'] + [line for _, _, line in clash_entries]),
+        (write_lines, os.path.join(merge_dir, 'sub_merge_clash.txt'), [link for link, _, _ in clash_entries]),
+        (write_lines, os.path.join(merge_dir, 'sub_merge_filtered.txt'), links),
+    ]
+    if clash_config_file:
+        jobs.append((write_clash_config, clash_config_file, clash_entries))
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        for future in [executor.submit(*job) for job in jobs]:
+            future.result()
+    return len(clash_entries)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# utils/sub_fetch.py 订阅源并发下载
+
+import asyncio, concurrent.futures, contextlib, threading, time
+from collections import deque
+from urllib.parse import urlsplit
+import aiohttp
+
+from sub_replay import replay_fetch
+
+# 默认下载参数，可由 config.ini 的 [fetch] 段覆盖
+DEFAULT_FETCH_CONFIG = {
+    'concurrency': 16, # 全局最大并发连接数
+    'per_host': 4,     # 单个域名最大并发连接数
+    'timeout': 15      # 单个订阅源的总超时（秒），从取得连接名额时开始计算
+}
+
+def fetch_settings(fetch_config={}):
+    """合并默认值与配置文件中的值（configparser 读出来的都是字符串）"""
+    settings = dict(DEFAULT_FETCH_CONFIG)
+    for key, value in fetch_config.items():
+        if key in settings and str(value).strip():
+            settings[key] = type(DEFAULT_FETCH_CONFIG[key])(value)
+    return settings
+
+def new_result(item):
+    return {'item': item, 'body': b'', 'status': None, 'headers': {}, 'error': None, 'error_class': None, 'elapsed': 0.0}
+
+class host_limits():
+    """全局与单域名的并发名额，在事件循环线程中创建"""
+    def __init__(self, concurrency, per_host):
+        self.total = asyncio.Semaphore(concurrency)
+        self.per_host = per_host
+        self.hosts = {}
+
+    @contextlib.asynccontextmanager
+    async def slot(self, url):
+        # 先排单域名的队，再占全局名额，等待同一域名时不占用其他域名的名额
+        host = urlsplit(url).hostname or ''
+        semaphore = self.hosts.setdefault(host, asyncio.Semaphore(self.per_host))
+        async with semaphore, self.total:
+            yield
+
+async def fetch_one(session, item, timeout, headers={}, archive=None, limits=None):
+    """
+    下载单个订阅源，永不抛出异常，错误写进结果字典；传入录制中的 archive 时同时保存响应。
+    传入 limits (host_limits) 时取得名额后才开始计时，排队等待不计入超时和耗时。
+    """
+    result = new_result(item)
+    all_headers = {}
+
+    async def request():
+        async with session.get(item['url'], headers=headers) as response:
+            result['status'] = response.status
+            all_headers.update(response.headers)
+            result['headers'] = {key: response.headers[key] for key in ('ETag', 'Last-Modified') if key in response.headers}
+            response.raise_for_status()
+            # 保留原始 bytes，由 sub_sniff 识别格式后一次性解码
+            result['body'] = await response.read()
+
+    async with limits.slot(item['url']) if limits else contextlib.nullcontext():
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(request(), timeout)
+        except asyncio.TimeoutError:
+            result['error'] = f'Timed out after {timeout}s'
+            result['error_class'] = 'Timeout'
+        except Exception as e:
+            result['error'] = str(e) or e.__class__.__name__
+            result['error_class'] = e.__class__.__name__
+        result['elapsed'] = time.monotonic() - start
+    if archive:
+        archive.record(item['url'], result['status'], all_headers, result['body'], result['elapsed'], result['error'], result['error_class'])
+    return result
+
+async def open_session(settings):
+    # 一个共享连接池：limit 为全局上限，limit_per_host 为单域名上限；
+    # 实际的排队由 host_limits 完成，连接池本身不会再让请求等待
+    connector = aiohttp.TCPConnector(limit=settings['concurrency'], limit_per_host=settings['per_host'])
+    limits = host_limits(settings['concurrency'], settings['per_host'])
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=None)), limits
+
+def iter_fetch(url_list, fetch_config={}, cache=None, archive=None, deadline=None):
+    """
+    并发下载 url_list 中的所有订阅源，按输入顺序逐个产出结果。
+    事件循环运行在后台线程，同时在途的下载最多为 2 倍的 concurrency，
+    调用方处理完一个结果后才会补充新的下载，内存中只保留这一小段窗口内的内容。
+    每个结果: {'item': 源条目, 'body': 原始内容 bytes, 'status': HTTP 状态码, 'headers': 缓存相关响应头, 'error': 错误信息或 None, 'error_class': 异常类名, 'elapsed': 耗时}
+    传入 cache (sub_cache.http_cache) 时发送条件请求，结果中另有 'hash' 和 'unchanged' 字段。
+    传入 archive (sub_replay.fetch_archive) 时录制或回放所有响应；录制时不发送条件请求，保证存档中有完整内容。
+    传入 deadline (time.monotonic() 的时刻) 时，到点后不再发起新的下载，已完成的结果照常产出，
+    其余取消；排在 url_list 后面的源最后取得连接名额，最先被舍弃。
+    """
+    items = iter([item for item in url_list if item.get('url')])
+    settings = fetch_settings(fetch_config)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    session, limits = asyncio.run_coroutine_threadsafe(open_session(settings), loop).result()
+
+    def submit():
+        if deadline and time.monotonic() >= deadline: return
+        item = next(items, None)
+        if item is None: return
+        headers = cache.conditional_headers(item['url']) if cache else {}
+        if archive and archive.replaying:
+            job = replay_fetch(archive, new_result(item), headers)
+        else:
+            job = fetch_one(session, item, settings['timeout'], {} if archive else headers, archive, limits)
+        pending.append(asyncio.run_coroutine_threadsafe(job, loop))
+
+    pending = deque()
+    try:
+        for _ in range(settings['concurrency'] * 2): submit()
+        while pending:
+            # 按输入顺序取结果，后续解析、去重的顺序与串行下载时一致
+            try:
+                result = pending[0].result(timeout=max(deadline - time.monotonic(), 0) if deadline else None)
+            except concurrent.futures.TimeoutError:
+                break
+            pending.popleft()
+            submit()
+            yield cache.resolve(result) if cache else result
+        # 到达 deadline：产出已经下载完的，取消其余的
+        while pending:
+            future = pending.popleft()
+            if future.done() and not future.cancelled():
+                result = future.result()
+                yield cache.resolve(result) if cache else result
+            else:
+                future.cancel()
+    finally:
+        for future in pending: future.cancel()
+        asyncio.run_coroutine_threadsafe(session.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+def fetch_all(url_list, fetch_config={}, cache=None, archive=None):
+    """一次性下载全部订阅源，按输入顺序返回结果列表，字段同 iter_fetch"""
+    return list(iter_fetch(url_list, fetch_config, cache, archive))
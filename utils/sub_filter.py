@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# utils/sub_filter.py 按备注过滤、重命名节点，对应 config.ini 中 [subconverter] 的配置
+
+import json, re, hashlib
+import urllib.parse
+
+from sub_node import base64_decode, base64_encode
+
+try:
+    import ahocorasick # pyahocorasick，可选，没有时关键词并入正则
+except ImportError:
+    ahocorasick = None
+
+# 多个规则之间与 subconverter 的链接参数一样用 ` 分隔
+SEPARATOR = '`'
+LEADING_FLAGS = re.compile(r'^\(\?([imsx]+)\)')
+BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+def split_rules(value):
+    return [rule for rule in (value or '').split(SEPARATOR) if rule]
+
+def is_keyword(pattern):
+    """不含任何正则元字符的规则按普通子串处理"""
+    return re.escape(pattern) == pattern
+
+def scoped(pattern):
+    """开头的 (?i) 等全局标志在合并后的正则中不合法，改写为只作用于本规则的 (?i:...)"""
+    match = LEADING_FLAGS.match(pattern)
+    if match:
+        return f'(?{match.group(1)}:{pattern[match.end():]})'
+    return f'(?:{pattern})'
+
+def combine(patterns):
+    """
+    把多条正则合并为一个带分支的正则。有规则含反向引用（合并后分组编号会错位）、
+    或合并后不合法（如两条规则有同名分组）时返回 None，由调用方逐条匹配。
+    """
+    if not patterns or any(BACKREFERENCE.search(pattern) for pattern in patterns):
+        return None
+    try:
+        return re.compile('|'.join(scoped(pattern) for pattern in patterns))
+    except re.error:
+        return None
+
+class pattern_set():
+    """
+    一组 include 或 exclude 规则编译为一个匹配器，判断一段备注时只扫描一次:
+    普通关键词放入 Aho-Corasick 自动机，其余正则合并为一个带分支的正则。
+    """
+    def __init__(self, rules):
+        self.rules = rules
+        keywords = [rule for rule in rules if is_keyword(rule)] if ahocorasick else []
+        patterns = [rule for rule in rules if rule not in keywords]
+        self.automaton = None
+        if keywords:
+            self.automaton = ahocorasick.Automaton()
+            for keyword in keywords: self.automaton.add_word(keyword, keyword)
+            self.automaton.make_automaton()
+        self.regex = combine(patterns)
+        self.patterns = [] if self.regex or not patterns else [re.compile(pattern) for pattern in patterns]
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def search(self, text):
+        if self.automaton and next(self.automaton.iter(text), None) is not None:
+            return True
+        if self.regex:
+            return bool(self.regex.search(text))
+        return any(pattern.search(text) for pattern in self.patterns)
+
+class remark_filter():
+    """
+    include_remarks / exclude_remarks 为正则，多个用 ` 分隔；rename 为 `正则@替换` 的列表。
+    apply 对一条分享链接返回过滤、重命名后的链接，被过滤掉时返回 None。
+    """
+    def __init__(self, format_config={}):
+        self.include = pattern_set(split_rules(format_config.get('include_remarks')))
+        self.exclude = pattern_set(split_rules(format_config.get('exclude_remarks')))
+        self.rename = []
+        for rule in split_rules(format_config.get('rename')):
+            pattern, _, replacement = rule.rpartition('@')
+            if pattern: self.rename.append((re.compile(pattern), replacement))
+        # 绝大多数备注不会命中任何重命名规则，先用合并后的正则判断一次再逐条替换；无法合并时每条备注都逐条替换
+        self.rename_any = combine([pattern.pattern for pattern, _ in self.rename])
+        raw = '\n'.join(str(format_config.get(key) or '') for key in ('include_remarks', 'exclude_remarks', 'rename'))
+        self.signature = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12] if self else ''
+
+    def __bool__(self):
+        return bool(self.include or self.exclude or self.rename)
+
+    def apply(self, link):
+        remarks, vmess_config = link_remarks(link)
+        if remarks is None:
+            return link
+        if self.include and not self.include.search(remarks):
+            return None
+        if self.exclude and self.exclude.search(remarks):
+            return None
+        if self.rename and (self.rename_any is None or self.rename_any.search(remarks)):
+            renamed = remarks
+            for pattern, replacement in self.rename:
+                renamed = pattern.sub(replacement, renamed)
+            if renamed != remarks:
+                return with_remarks(link, renamed, vmess_config)
+        return link
+
+    def filter_links(self, links):
+        """逐个产出保留下来的链接，可以直接接在解析流程后面"""
+        for link in links:
+            link = self.apply(link)
+            if link: yield link
+
+def link_remarks(link):
+    """返回 (备注, vmess 配置)；vmess 的备注在 ps 字段，其他协议在 # 之后"""
+    protocol, _, rest = link.partition('://')
+    if protocol == 'vmess':
+        try:
+            config = json.loads(base64_decode(rest.split('#')[0]))
+            return str(config.get('ps', '')), config
+        except Exception:
+            return None, None
+    _, _, remarks = rest.partition('#')
+    return urllib.parse.unquote(remarks), None
+
+def with_remarks(link, remarks, vmess_config=None):
+    if vmess_config is not None:
+        vmess_config['ps'] = remarks
+        return f"vmess://{base64_encode(json.dumps(vmess_config, separators=(',', ':'), ensure_ascii=False))}"
+    return f"{link.split('#')[0]}#{urllib.parse.quote(remarks)}"
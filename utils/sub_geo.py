@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# utils/sub_geo.py 按服务器 IP 所在国家重命名节点，并一次写出按地区拆分的 provider 文件
+
+import json, os, hashlib, socket, ipaddress
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import requests
+
+from sub_emit import share_link_to_clash, clash_line, write_lines
+
+try:
+    import maxminddb # geoip2 的依赖，直接用它读取，不受数据库类型名的限制
+except ImportError:
+    maxminddb = None
+
+MMDB_URL = 'https://raw.githubusercontent.com/Loyalsoldier/geoip/release/Country.mmdb'
+# 单独拆分出文件的地区，其余归入 others
+REGIONS = ('hk', 'us', 'sg')
+
+def download_mmdb(path, url=MMDB_URL, timeout=60, session=requests):
+    """
+    条件下载数据库：旁边的 <path>.json 记录 ETag / Last-Modified / sha256，
+    服务器返回 304 或内容哈希不变时不替换文件。返回文件是否有更新。
+    session 可以是挂载了 sub_replay 存档的 requests.Session。
+    """
+    meta_file = path + '.json'
+    try:
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except Exception:
+        meta = {}
+    headers = {}
+    if os.path.exists(path):
+        if meta.get('etag'): headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'): headers['If-Modified-Since'] = meta['last_modified']
+    with session.get(url, headers=headers, timeout=timeout, stream=True) as resp:
+        if resp.status_code == 304:
+            return False
+        resp.raise_for_status()
+        digest = hashlib.sha256()
+        temp_file = path + '.tmp'
+        with open(temp_file, 'wb') as f:
+            for chunk in resp.iter_content(1 << 16):
+                digest.update(chunk)
+                f.write(chunk)
+        content_hash = digest.hexdigest()
+        changed = content_hash != meta.get('sha256') or not os.path.exists(path)
+        if changed:
+            os.replace(temp_file, path)
+        else:
+            os.remove(temp_file)
+        meta = {'etag': resp.headers.get('ETag'), 'last_modified': resp.headers.get('Last-Modified'), 'sha256': content_hash}
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    return changed
+
+def flag(code):
+    """ISO 国家代码转为旗帜 emoji"""
+    return ''.join(chr(0x1F1E6 + ord(c) - ord('A')) for c in code.upper())
+
+class geo_lookup():
+    """
+    以内存映射方式打开 Country.mmdb，整个运行期间只打开一次。
+    域名解析和 IP → 国家查询都带缓存，同一个服务器只解析、查询一次。
+    """
+    def __init__(self, mmdb_file, resolve_workers=64, cache_size=65536, resolver=None):
+        self.reader = maxminddb.open_database(mmdb_file, maxminddb.MODE_MMAP)
+        self.resolve_workers = resolve_workers
+        self.resolver = resolver # 可选的 sub_dns.dns_cache，提供时用它批量异步解析
+        self.addresses = {} # host -> ip
+        self.country = lru_cache(maxsize=cache_size)(self._country)
+
+    def close(self):
+        self.reader.close()
+
+    def _country(self, ip):
+        try:
+            record = self.reader.get(ip) or {}
+            return (record.get('country') or record.get('registered_country') or {}).get('iso_code')
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _resolve(host):
+        try:
+            ipaddress.ip_address(host)
+            return host
+        except ValueError:
+            pass
+        try:
+            return socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)[0][4][0]
+        except (OSError, UnicodeError):
+            return None
+
+    def resolve_all(self, hosts):
+        """并发解析还没有缓存的域名"""
+        pending = [host for host in set(hosts) if host not in self.addresses]
+        if pending and self.resolver:
+            self.addresses.update(self.resolver.resolve_all(pending))
+        elif pending:
+            with ThreadPoolExecutor(max_workers=self.resolve_workers) as executor:
+                self.addresses.update(zip(pending, executor.map(self._resolve, pending)))
+        return self.addresses
+
+def write_providers(provider_dir, links, geo):
+    """
+    一次遍历完成: 解析服务器国家 → 分到各地区 → 重命名为 '旗帜国家代码-IP-序号'，
+    序号在各地区内从 00 开始编号；写出 provider-all.yml 和 provider-<地区>.yml，返回各文件的节点数。
+    """
+    proxies = [proxy for proxy in map(share_link_to_clash, links) if proxy]
+    addresses = geo.resolve_all(proxy['server'] for proxy in proxies)
+    buckets = {region: [] for region in ('all',) + REGIONS + ('others',)}
+    for proxy in proxies:
+        ip = addresses.get(proxy['server'])
+        code = geo.country(ip) if ip else None
+        region = code.lower() if code and code.lower() in REGIONS else 'others'
+        # 查不到国家的（多为 CDN 中转）沿用原来的 RELAY 标记；同一地区内序号不重复，名称在 provider-all 中也唯一
+        proxy['name'] = f"{flag(code) if code else '🏁'}{code or 'RELAY'}-{ip or proxy['server']}-{len(buckets[region]):02d}"
+        line = clash_line(proxy)
+        buckets['all'].append(line)
+        buckets[region].append(line)
+    os.makedirs(provider_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=len(buckets)) as executor:
+        for future in [executor.submit(write_lines, os.path.join(provider_dir, f'provider-{region}.yml'), ['proxies:'] + lines)
+                       for region, lines in buckets.items()]:
+            future.result()
+    return {region: len(lines) for region, lines in buckets.items()}
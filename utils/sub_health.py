@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# utils/sub_health.py 节点测速历史（SQLite），近期测过且远离入选线的节点直接沿用上次的成绩
+
+import json, sqlite3, time
+
+from sub_node import parse_share_link
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS nodes (
+    fingerprint TEXT PRIMARY KEY,
+    link        TEXT NOT NULL,
+    last_seen   INTEGER NOT NULL,
+    last_tested INTEGER,
+    ping        INTEGER NOT NULL DEFAULT 0,
+    avg_speed   INTEGER NOT NULL DEFAULT 0,
+    max_speed   INTEGER NOT NULL DEFAULT 0,
+    failures    INTEGER NOT NULL DEFAULT 0
+)
+'''
+
+def fingerprint_key(link):
+    """与合并去重相同的指纹，序列化为文本作为主键；无法解析时用链接本身"""
+    node = parse_share_link(link)
+    return json.dumps(node.fingerprint, ensure_ascii=False) if node else link
+
+def score(row):
+    """排序键：速度高的在前，速度相同时延迟低的在前，不可用的排在最后"""
+    ok = row['avg_speed'] > 0 or row['ping'] > 0
+    return (ok, row['avg_speed'], -row['ping'] if row['ping'] > 0 else -float('inf'))
+
+class health_db():
+    """
+    nodes 表以指纹为主键，记录 最后出现 / 最后测试 时间、延迟、平均与最大速度、连续失败次数。
+    plan 决定本次需要重新测试的节点，record 写回测速结果，ranked 合并新旧成绩排序。
+    ping_only 为 True 时（lite 的 speedtestMode 为 pingonly，没有速度数据）入选线按延迟计算。
+    """
+    def __init__(self, db_file, ttl=86400, margin=0.2, expire=7 * 86400, ping_only=False, max_backoff=3):
+        self.ttl = ttl          # 超过 ttl 秒没有测试的结果视为过期
+        self.margin = margin    # 成绩与入选线相差不到 margin 比例的节点重新测试
+        self.expire = expire    # 超过 expire 秒没有出现的节点从库中删除
+        self.ping_only = ping_only
+        self.max_backoff = max_backoff # 连续失败的节点每多失败一次过期时间翻倍，最多翻 max_backoff 次
+        self.now = int(time.time())
+        self.conn = sqlite3.connect(db_file)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(SCHEMA)
+
+    def close(self):
+        self.conn.execute('DELETE FROM nodes WHERE last_seen < ?', (self.now - self.expire,))
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup(self, keys):
+        rows = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500): # SQLite 单条语句的参数个数有上限
+            chunk = keys[i:i + 500]
+            query = f"SELECT * FROM nodes WHERE fingerprint IN ({','.join('?' * len(chunk))})"
+            rows.update((row['fingerprint'], dict(row)) for row in self.conn.execute(query, chunk))
+        return rows
+
+    def due(self, row):
+        """没有测过或结果已过期；连续失败 n 次的节点过期时间为 ttl * 2^(n-1)，不可用的节点不必每次都测"""
+        if not row['last_tested']:
+            return True
+        ttl = self.ttl * 2 ** min(max(row['failures'] - 1, 0), self.max_backoff)
+        return self.now - row['last_tested'] >= ttl
+
+    def plan(self, links, cutoff_rank=None):
+        """
+        返回需要测试的链接（保持原顺序）。新节点、结果过期的节点，以及成绩在第 cutoff_rank 名
+        附近（速度或 ping_only 时的延迟相差不到 margin）的节点需要测试，其余沿用库中的成绩。
+        同时更新所有节点的最后出现时间。
+        """
+        self.keys = {link: fingerprint_key(link) for link in links}
+        self.conn.executemany(
+            'INSERT INTO nodes (fingerprint, link, last_seen) VALUES (?, ?, ?) '
+            'ON CONFLICT(fingerprint) DO UPDATE SET link = excluded.link, last_seen = excluded.last_seen',
+            [(key, link, self.now) for link, key in self.keys.items()]
+        )
+        self.conn.commit()
+        rows = self.lookup(self.keys.values())
+        fresh = [row for row in rows.values() if not self.due(row)]
+        metric = 'ping' if self.ping_only else 'avg_speed'
+        cutoff = None
+        if cutoff_rank and fresh:
+            ranked = sorted(fresh, key=score, reverse=True)
+            cutoff = ranked[min(cutoff_rank, len(ranked)) - 1][metric]
+        to_test = []
+        for link, key in self.keys.items():
+            row = rows[key]
+            if self.due(row):
+                to_test.append(link)
+            elif cutoff and row[metric] > 0 and abs(row[metric] - cutoff) <= cutoff * self.margin:
+                to_test.append(link)
+        return to_test
+
+    def record(self, tested_links, results):
+        """
+        results 为测速结果（含 Link、ping、avg_speed、max_speed），tested_links 中没有结果的记为失败。
+        结果按节点指纹对应，lite 改写了链接的写法或备注也能匹配。
+        """
+        by_key = {fingerprint_key(result['Link']): result for result in results if result.get('Link')}
+        updates = []
+        for link in tested_links:
+            key = self.keys.get(link) or fingerprint_key(link)
+            result = by_key.get(key)
+            if result:
+                ping = int(result['ping']) if str(result['ping']).isdigit() else 0
+                avg_speed = int(result['avg_speed'])
+                # 延迟和速度都为 0 的结果与没有结果一样，计入连续失败
+                updates.append((self.now, ping, avg_speed, int(result['max_speed']), int(not (ping or avg_speed)), key))
+            else:
+                updates.append((self.now, 0, 0, 0, 1, key))
+        self.conn.executemany(
+            'UPDATE nodes SET last_tested = ?, ping = ?, avg_speed = ?, max_speed = ?, '
+            'failures = CASE WHEN ? THEN failures + 1 ELSE 0 END WHERE fingerprint = ?',
+            updates
+        )
+        self.conn.commit()
+
+    def ranked(self, links):
+        """按库中（已包含本次结果）的成绩对 links 排序，只返回可用的节点"""
+        keys = {link: self.keys.get(link) or fingerprint_key(link) for link in links}
+        rows = self.lookup(keys.values())
+        usable = [(score(rows[key]), link) for link, key in keys.items()
+                  if key in rows and rows[key]['last_tested'] and score(rows[key])[0]]
+        usable.sort(key=lambda item: item[0], reverse=True)
+        return [link for _, link in usable]
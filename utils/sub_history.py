@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+# utils/sub_history.py update/ 每日节点快照的压缩存档：每个节点只存一次，按天记录节点编号
+"""
+存档目录中过去的每个月一个分段 YYMM.zip，当月每天一个单日分段 YYMMDD.zip。
+每次运行只写当天的单日分段，进入新的一个月后把上个月的单日分段合并为月分段并删除，
+每个分段写出后不再改写（同一天多次运行时只重写当天的分段），git 仓库按天线性增长。
+
+每个分段是一个 zip 文件，成员单独用 LZMA 压缩:
+    header.json         {'version', 'days': ['YYMMDD', ...], 'newline': '0101...', 'node_count', 'block_size'}
+                        newline 的第 i 位表示第 i 天的原文件是否以换行结尾
+    nodes/<块号>        按首次出现顺序编号的节点链接，每 block_size 个一块，以换行连接
+    day_offsets.bin     uint32 数组，第 i 天的节点编号位于 day_nodes[day_offsets[i]:day_offsets[i + 1]]
+    day_nodes.bin       uint32 数组，各天按原文件行顺序排列的节点编号
+    node_offsets.bin    uint32 数组，节点 j 出现的天位于 node_days[node_offsets[j]:node_offsets[j + 1]]
+    node_days.bin       uint32 数组，各节点出现的天的序号（升序）
+    lookup_keys.bin     uint64 数组，链接 sha1 前 8 字节，升序，用二分查找
+    lookup_ids.bin      uint32 数组，与 lookup_keys 一一对应的节点编号
+读取某一天只解压成员表和用到的节点块，查询某个节点出现的天只解压各分段的索引，都不需要扫描全部快照。
+数组均以小端序保存。
+
+命令行（在 utils 目录下）:
+    python sub_history.py build ../update ../update/history         由 YYMM/YYMMDD.txt 生成存档
+    python sub_history.py extract ../update/history ../update       还原为原来的目录结构
+    python sub_history.py day ../update/history 230101              输出某一天的快照
+    python sub_history.py node ../update/history 'vmess://...'      列出节点出现过的日期
+"""
+
+import argparse, hashlib, json, os, re, sys, zipfile
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+
+HISTORY_VERSION = 1
+BLOCK_SIZE = 1024
+DAY_FILE = re.compile(r'^(\d{6})\.txt$')
+SEGMENT_FILE = re.compile(r'^(\d{4}|\d{6})\.zip$')
+
+def _dump(values, typecode):
+    data = array(typecode, values)
+    if sys.byteorder == 'big': data.byteswap()
+    return data.tobytes()
+
+def _load(raw, typecode):
+    data = array(typecode)
+    data.frombytes(raw)
+    if sys.byteorder == 'big': data.byteswap()
+    return data
+
+def link_key(link):
+    return int.from_bytes(hashlib.sha1(link.encode('utf-8')).digest()[:8], 'little')
+
+def build_archive(archive_file, snapshots, block_size=BLOCK_SIZE):
+    """
+    snapshots 为 (日期 'YYMMDD', 文件内容 str) 的可迭代对象，同一天出现多次时以最后一次为准。
+    写出存档并返回 (天数, 节点数)。
+    """
+    contents = dict(snapshots)
+    days = sorted(contents)
+    ids, links = {}, []
+    day_offsets, day_nodes, newline = [0], [], []
+    node_days = []
+    for day_index, day in enumerate(days):
+        text = contents[day]
+        newline.append('1' if text.endswith('\n') else '0')
+        for link in (text[:-1] if text.endswith('\n') else text).split('\n') if text else []:
+            node_id = ids.get(link)
+            if node_id is None:
+                node_id = ids[link] = len(links)
+                links.append(link)
+                node_days.append([])
+            day_nodes.append(node_id)
+            if not node_days[node_id] or node_days[node_id][-1] != day_index:
+                node_days[node_id].append(day_index)
+        day_offsets.append(len(day_nodes))
+    node_offsets = [0]
+    for entries in node_days:
+        node_offsets.append(node_offsets[-1] + len(entries))
+    lookup = sorted((link_key(link), node_id) for node_id, link in enumerate(links))
+    header = {'version': HISTORY_VERSION, 'days': days, 'newline': ''.join(newline),
+              'node_count': len(links), 'block_size': block_size}
+
+    os.makedirs(os.path.dirname(archive_file) or '.', exist_ok=True)
+    temp_file = archive_file + '.tmp'
+    with zipfile.ZipFile(temp_file, 'w', zipfile.ZIP_LZMA) as archive:
+        def write(name, data):
+            # 固定的成员时间，内容不变时重新生成的分段逐字节相同，git 中不产生新版本
+            archive.writestr(zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0)), data, zipfile.ZIP_LZMA)
+        write('header.json', json.dumps(header))
+        for block in range(0, len(links), block_size):
+            write(f'nodes/{block // block_size:06d}', '\n'.join(links[block:block + block_size]))
+        write('day_offsets.bin', _dump(day_offsets, 'I'))
+        write('day_nodes.bin', _dump(day_nodes, 'I'))
+        write('node_offsets.bin', _dump(node_offsets, 'I'))
+        write('node_days.bin', _dump((day for entries in node_days for day in entries), 'I'))
+        write('lookup_keys.bin', _dump((key for key, _ in lookup), 'Q'))
+        write('lookup_ids.bin', _dump((node_id for _, node_id in lookup), 'I'))
+    os.replace(temp_file, archive_file)
+    return len(days), len(links)
+
+def scan_update_dir(update_dir):
+    """逐个产出 update_dir 下 YYMM/YYMMDD.txt 快照的 (日期, 内容)"""
+    for month in sorted(os.listdir(update_dir)):
+        month_dir = os.path.join(update_dir, month)
+        if not os.path.isdir(month_dir): continue
+        for name in sorted(os.listdir(month_dir)):
+            match = DAY_FILE.match(name)
+            if match:
+                with open(os.path.join(month_dir, name), 'r', encoding='utf-8', newline='') as f:
+                    yield match.group(1), f.read()
+
+class history_archive():
+    """只读打开存档，各成员在第一次用到时才解压"""
+    def __init__(self, archive_file):
+        self.zip = zipfile.ZipFile(archive_file, 'r')
+        self.header = json.loads(self.zip.read('header.json'))
+        if self.header.get('version') != HISTORY_VERSION:
+            raise ValueError(f'Unsupported history version: {self.header.get("version")}')
+        self.days = self.header['days']
+        self.day_index = {day: index for index, day in enumerate(self.days)}
+        self.block = lru_cache(maxsize=16)(self._block)
+        self.arrays = {}
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _array(self, name, typecode='I'):
+        if name not in self.arrays:
+            self.arrays[name] = _load(self.zip.read(name), typecode)
+        return self.arrays[name]
+
+    def _block(self, number):
+        return self.zip.read(f'nodes/{number:06d}').decode('utf-8').split('\n')
+
+    def node(self, node_id):
+        block_size = self.header['block_size']
+        return self.block(node_id // block_size)[node_id % block_size]
+
+    def snapshots(self):
+        """按日期顺序产出所有 (日期, 内容)"""
+        for day in self.days:
+            yield day, self.read_day(day)
+
+    def day_links(self, day):
+        """某一天的节点链接，顺序与原文件相同；没有这一天时抛出 KeyError"""
+        index = self.day_index[day]
+        offsets = self._array('day_offsets.bin')
+        return [self.node(node_id) for node_id in self._array('day_nodes.bin')[offsets[index]:offsets[index + 1]]]
+
+    def read_day(self, day):
+        """还原某一天的文件内容，与原文件逐字节相同"""
+        text = '\n'.join(self.day_links(day))
+        return text + '\n' if self.header['newline'][self.day_index[day]] == '1' else text
+
+    def node_id(self, link):
+        keys = self._array('lookup_keys.bin', 'Q')
+        key = link_key(link)
+        position = bisect_left(keys, key)
+        ids = self._array('lookup_ids.bin')
+        # 哈希前缀相同的极少数情况下逐个比对原链接
+        while position < len(keys) and keys[position] == key:
+            if self.node(ids[position]) == link:
+                return ids[position]
+            position += 1
+        return None
+
+    def node_days(self, link):
+        """节点出现过的日期列表，从未出现时为空列表"""
+        node_id = self.node_id(link)
+        if node_id is None:
+            return []
+        offsets = self._array('node_offsets.bin')
+        return [self.days[index] for index in self._array('node_days.bin')[offsets[node_id]:offsets[node_id + 1]]]
+
+def segment_file(history_dir, name):
+    """name 为月份 YYMM 或日期 YYMMDD"""
+    return os.path.join(history_dir, f'{name}.zip')
+
+class history_store():
+    """
+    存档目录，包含月分段 YYMM.zip 和单日分段 YYMMDD.zip，同一天只在其中一个分段里；
+    分段在第一次用到时才打开。
+    """
+    def __init__(self, history_dir):
+        self.history_dir = history_dir
+        names = os.listdir(history_dir) if os.path.isdir(history_dir) else []
+        # YYMM 排在同月的 YYMMDD 之前，按名称顺序读出的日期即为升序
+        self.names = sorted(match.group(1) for match in map(SEGMENT_FILE.match, names) if match)
+        self.segments = {}
+
+    def close(self):
+        for segment in self.segments.values():
+            segment.close()
+        self.segments.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def segment(self, name):
+        if name not in self.segments:
+            self.segments[name] = history_archive(segment_file(self.history_dir, name))
+        return self.segments[name]
+
+    @property
+    def days(self):
+        return [day for name in self.names for day in self.segment(name).days]
+
+    def snapshots(self):
+        for name in self.names:
+            yield from self.segment(name).snapshots()
+
+    def read_day(self, day):
+        """还原某一天的文件内容；没有这一天时抛出 KeyError"""
+        if day in self.names:
+            return self.segment(day).read_day(day)
+        if day[:4] in self.names:
+            return self.segment(day[:4]).read_day(day)
+        raise KeyError(day)
+
+    def node_days(self, link):
+        """节点出现过的日期列表（升序）"""
+        return [day for name in self.names for day in self.segment(name).node_days(link)]
+
+def build_store(history_dir, snapshots):
+    """把 (日期, 内容) 按月写成各个分段，返回 (天数, 节点数)，节点数为各分段之和"""
+    months = {}
+    for day, text in snapshots:
+        months.setdefault(day[:4], []).append((day, text))
+    day_count = node_count = 0
+    for month, entries in months.items():
+        days, nodes = build_archive(segment_file(history_dir, month), entries)
+        day_count, node_count = day_count + days, node_count + nodes
+    return day_count, node_count
+
+def consolidate(history_dir, before):
+    """把 before (YYMM) 之前各月的单日分段合并进月分段并删除，返回合并了的月份"""
+    with history_store(history_dir) as history:
+        daily = [name for name in history.names if len(name) == 6 and name[:4] < before]
+        months = sorted({name[:4] for name in daily})
+        for month in months:
+            snapshots = list(history.segment(month).snapshots()) if month in history.names else []
+            snapshots += [snapshot for name in daily if name[:4] == month for snapshot in history.segment(name).snapshots()]
+            build_archive(segment_file(history_dir, month), snapshots)
+    for name in daily:
+        os.remove(segment_file(history_dir, name))
+    return months
+
+def add_day(history_dir, day, text):
+    """
+    把一天的快照写成单日分段（同一天已存在时替换），再合并之前各月的单日分段。
+    返回 (这一天的节点数, 合并了的月份)。
+    """
+    month_file = segment_file(history_dir, day[:4])
+    replaced = False
+    if os.path.exists(month_file):
+        with history_archive(month_file) as history:
+            if day in history.day_index:
+                # 已合并月份中的某一天重新写入（极少见）：重写该月分段
+                snapshots = [(old_day, content) for old_day, content in history.snapshots() if old_day != day]
+                replaced = True
+    if replaced:
+        build_archive(month_file, snapshots + [(day, text)])
+    else:
+        build_archive(segment_file(history_dir, day), [(day, text)])
+    node_count = len(set(text.splitlines()))
+    return node_count, consolidate(history_dir, day[:4])
+
+def extract(history_dir, update_dir):
+    """把存档还原为 update_dir/YYMM/YYMMDD.txt，返回天数"""
+    count = 0
+    with history_store(history_dir) as history:
+        for day, content in history.snapshots():
+            os.makedirs(os.path.join(update_dir, day[:4]), exist_ok=True)
+            with open(os.path.join(update_dir, day[:4], f'{day}.txt'), 'w', encoding='utf-8', newline='') as f:
+                f.write(content)
+            count += 1
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compressed archive of the daily node snapshots in update/.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('build', help='Build the archive from YYMM/YYMMDD.txt snapshots')
+    command.add_argument('update_dir')
+    command.add_argument('history_dir')
+    command = commands.add_parser('extract', help='Write the snapshots back as YYMM/YYMMDD.txt')
+    command.add_argument('history_dir')
+    command.add_argument('update_dir')
+    command = commands.add_parser('day', help='Print the snapshot of one day (YYMMDD)')
+    command.add_argument('history_dir')
+    command.add_argument('day')
+    command = commands.add_parser('node', help='List the days a node link appeared')
+    command.add_argument('history_dir')
+    command.add_argument('link')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        day_count, node_count = build_store(args.history_dir, scan_update_dir(args.update_dir))
+        size = sum(os.path.getsize(os.path.join(args.history_dir, name)) for name in os.listdir(args.history_dir))
+        print(f'Archived {day_count} days, {node_count} nodes to {args.history_dir} ({size} bytes).')
+    elif args.command == 'extract':
+        print(f'Extracted {extract(args.history_dir, args.update_dir)} days to {args.update_dir}.')
+    else:
+        with history_store(args.history_dir) as history:
+            if args.command == 'day':
+                sys.stdout.write(history.read_day(args.day))
+            else:
+                print('\n'.join(history.node_days(args.link)))
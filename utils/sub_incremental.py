@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# utils/sub_incremental.py 增量合并：复用未变化订阅源的解析结果，只重算变化的部分
+
+import json, os, bisect
+
+# 指纹格式变化时提升版本号，旧状态文件会被丢弃并全量重建
+STATE_VERSION = 2
+
+class merge_state():
+    """
+    持久化的合并状态:
+        order    上次参与合并的源（按列表顺序）
+        sources  { 源 key: {'hash': 内容哈希, 'nodes': [[指纹, 链接], ...]} }，指纹为 Node.fingerprint，每个源内不重复
+        output   上次输出的已排序链接列表
+    去重规则与 merge.deduplicate_nodes 一致：同一指纹保留列表中最靠前的源里第一次出现的链接。
+    """
+    def __init__(self, state_file):
+        self.state_file = state_file
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception:
+            state = {}
+        if state.get('version') != STATE_VERSION:
+            state = {}
+        self.old_order = state.get('order', [])
+        self.old_sources = {
+            key: {'hash': source['hash'], 'nodes': [(tuple(fp), link) for fp, link in source['nodes']]}
+            for key, source in state.get('sources', {}).items()
+        }
+        self.old_output = state.get('output', [])
+        self.order = []
+        self.sources = {}
+        self.changed = set() # 内容变化、新增的源
+
+    def is_unchanged(self, key, content_hash):
+        source = self.old_sources.get(key)
+        return bool(content_hash) and source is not None and source['hash'] == content_hash
+
+    def keep_source(self, key):
+        """源内容没有变化，直接沿用上次的快照"""
+        self.order.append(key)
+        self.sources[key] = self.old_sources[key]
+        return len(self.sources[key]['nodes'])
+
+    def update_source(self, key, content_hash, entries):
+        """记录一个重新解析过的源，entries 为按出现顺序的 (指纹, 链接)"""
+        nodes, seen = [], set()
+        for fp, link in entries:
+            if fp in seen: continue
+            seen.add(fp)
+            nodes.append((fp, link))
+        self.order.append(key)
+        self.sources[key] = {'hash': content_hash, 'nodes': nodes}
+        self.changed.add(key)
+
+    @staticmethod
+    def _winners(order, sources, fps=None):
+        """计算指纹 -> 保留链接；fps 不为空时只计算这些指纹"""
+        winners = {}
+        for key in order:
+            for fp, link in sources[key]['nodes']:
+                if fps is not None and fp not in fps: continue
+                if fp not in winners: winners[fp] = link
+        return winners
+
+    def finalize(self):
+        """返回 (排序后的输出链接, 新增数, 删除数)"""
+        common = [key for key in self.order if key in self.old_sources]
+        old_common = [key for key in self.old_order if key in self.sources]
+        if common != old_common or not self.old_output and self.old_order:
+            # 源的相对顺序变化会影响去重时保留哪一个链接，直接全量重算（仍然不需要重新解析）
+            output = sorted(self._winners(self.order, self.sources).values())
+            old = set(self.old_output)
+            added = sum(1 for link in output if link not in old)
+            self.output = output
+            return output, added, len(old) - (len(output) - added)
+
+        # 受影响的指纹：来自新增、变化、移除的源
+        dirty = self.changed | (set(self.old_order) - set(self.order))
+        affected = set()
+        for key in dirty:
+            for sources in (self.sources, self.old_sources):
+                if key in sources:
+                    affected.update(fp for fp, _ in sources[key]['nodes'])
+        old_winners = self._winners(self.old_order, self.old_sources, affected)
+        new_winners = self._winners(self.order, self.sources, affected)
+
+        output = list(self.old_output)
+        removed = [link for fp, link in old_winners.items() if new_winners.get(fp) != link]
+        added = [link for fp, link in new_winners.items() if old_winners.get(fp) != link]
+        if len(removed) + len(added) > len(output) // 4:
+            # 变化太多时全量排序更快
+            drop = set(removed)
+            output = sorted([link for link in output if link not in drop] + added)
+        else:
+            for link in removed:
+                index = bisect.bisect_left(output, link)
+                if index < len(output) and output[index] == link: output.pop(index)
+            for link in added:
+                bisect.insort(output, link)
+        self.output = output
+        return output, len(added), len(removed)
+
+    def save(self):
+        state = {
+            'version': STATE_VERSION,
+            'order': self.order,
+            'sources': {key: {'hash': source['hash'], 'nodes': source['nodes']} for key, source in self.sources.items()},
+            'output': self.output
+        }
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        temp_file = self.state_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_file, self.state_file)
@@ -1,37 +1,102 @@
 #!/usr/bin/env python3
 
-import json, os, base64, time, requests, re
+import json, os, base64, time, re
+import multiprocessing
 import yaml
-import urllib.parse
-
-def base64_decode(s):
-    try:
-        s = s.strip()
-        missing_padding = len(s) % 4
-        if missing_padding: s += '=' * (4 - missing_padding)
-        return base64.b64decode(s).decode('utf-8', 'ignore')
-    except: return ""
-
-def base64_encode(s):
-    return base64.b64encode(s.encode('utf-8')).decode('ascii')
-
-def is_base64(s):
-    s = s.strip()
-    if not re.match(r'^[A-Za-z0-9+/]*=?=?$', s): return False
-    if len(s) % 4 != 0: s += '=' * (4 - (len(s) % 4))
-    try:
-        base64.b64decode(s, validate=True)
-        return True
-    except Exception:
-        return False
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from collections import deque
+from itertools import chain, islice
+
+from sub_fetch import iter_fetch
+from sub_cache import http_cache
+from sub_incremental import merge_state
+from sub_sniff import sniff_content, iter_share_links
+from sub_node import parse_share_link, clash_to_share_link, map_each
+from sub_emit import emit_outputs
+from sub_filter import remark_filter
+from sub_dns import dns_cache
+from sub_metrics import metrics
+from sub_score import source_scores
+
+# 有 libyaml 时使用 C 实现的加载器，速度快一个数量级
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+TOP_LEVEL_LINE = re.compile(r'^(?![\s#-])\S', re.M)
+PROXIES_KEY = re.compile(r'^proxies:', re.M)
+
+def load_clash_proxies(text):
+    """
+    只解析 Clash 配置中顶层的 proxies 段，跳过 rules、proxy-groups 等往往更长的部分。
+    proxies 段引用了段外的锚点等切分后无法解析的情况，退回完整解析。
+    """
+    start = PROXIES_KEY.search(text)
+    if start:
+        end = TOP_LEVEL_LINE.search(text, start.end())
+        section = text[start.start():end.start() if end else len(text)]
+        try:
+            data = yaml.load(section, Loader=YAML_LOADER)
+            if isinstance(data, dict):
+                return data.get('proxies') or []
+        except yaml.YAMLError:
+            pass
+    data = yaml.load(text, Loader=YAML_LOADER)
+    return (data.get('proxies') if isinstance(data, dict) else None) or []
+
+class CountingIterator():
+    """包装一个可迭代对象，记录已经产出的元素个数"""
+    def __init__(self, iterable):
+        self.iterable = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        for value in self.iterable:
+            self.count += 1
+            yield value
+
+def pool_context():
+    """
+    解析进程池创建时下载线程已在运行，fork 出的子进程可能继承其他线程持有的锁；
+    支持时改用 forkserver，由干净的服务进程派生工作进程。
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
 
 class merge():
-    def __init__(self,file_dir,format_config):
+    def __init__(self,file_dir,format_config,fetch_config={},dns_config={},archive=None):
         self.list_dir = file_dir['list_dir']
         self.list_file = file_dir['list_file']
         self.merge_dir = file_dir['merge_dir']
         self.readme_file = file_dir.get('readme_file')
+        self.clash_config_file = file_dir.get('clash_config_file')
         self.format_config = format_config
+        # [subconverter] 中的 include_remarks / exclude_remarks / rename / deduplicate
+        self.remark_filter = remark_filter(format_config)
+        self.deduplicate = str(format_config.get('deduplicate', 'true')).lower() != 'false'
+        # 解析域名后按 IP 再去重一次，域名解析结果带 TTL 缓存在 cache_dir
+        self.resolver = None
+        if self.deduplicate and str(file_dir.get('resolve_dedupe', 'false')).lower() == 'true':
+            cache_file = os.path.join(file_dir['cache_dir'], 'dns_cache.json') if file_dir.get('cache_dir') else None
+            self.resolver = dns_cache(cache_file, dns_config)
+        self.fetch_config = fetch_config
+        self.archive = archive # sub_replay.fetch_archive，录制或回放下载
+        # 按各源的历史表现排定下载顺序、跳过持续失败或没有贡献的源（统计保存在 cache_dir）
+        self.scores = None
+        if file_dir.get('cache_dir') and str(fetch_config.get('schedule', 'false')).lower() == 'true':
+            self.scores = source_scores(os.path.join(file_dir['cache_dir'], 'source_stats.json'), fetch_config)
+        # 大源并行解析：parse_workers 为 0 时全部在本进程解析
+        self.parse_workers = int(file_dir.get('parse_workers') or 0)
+        self.parse_threshold = int(file_dir.get('parse_threshold') or 20000)
+        self.parse_pool = None
+        # 配置了 cache_dir 时启用条件请求缓存
+        self.cache = http_cache(file_dir['cache_dir']) if file_dir.get('cache_dir') else None
+        # 增量合并依赖缓存提供的内容哈希
+        self.state = None
+        if self.cache and str(file_dir.get('incremental_merge', 'false')).lower() == 'true':
+            self.state = merge_state(os.path.join(file_dir['cache_dir'], 'merge_state.json'))
+        if self.scores and self.scores.settings['budget'] and not self.state:
+            # 超出预算的源要靠增量状态沿用上次的结果，否则它们的节点会从输出中消失
+            print('Fetch budget requires incremental_merge=true, fetching all sources without a time limit.')
+            self.scores.settings['budget'] = 0.0
         self.url_list = self.read_list()
         self.sub_merge()
         if self.readme_file:
@@ -42,195 +107,288 @@ class merge():
             return [item for item in json.load(f) if item.get('enabled')]
 
     def parse_share_link(self, link):
-        """将任何分享链接解析为包含核心指纹的字典"""
-        try:
-            protocol, rest = link.split("://", 1)
-            # 移除 #remarks 部分
-            main_part = rest.split('#')[0]
-            
-            fingerprint_parts = {'protocol': protocol}
-
-            if protocol == 'vmess':
-                config = json.loads(base64_decode(main_part))
-                fingerprint_parts['server'] = config.get('add', '')
-                fingerprint_parts['port'] = config.get('port', '')
-                fingerprint_parts['id'] = config.get('id', '')
-            elif protocol in ['vless', 'trojan']:
-                user_info, server_info = main_part.split('@', 1)
-                server, port = server_info.split('?')[0].split(':')
-                fingerprint_parts['id'] = user_info
-                fingerprint_parts['server'] = server
-                fingerprint_parts['port'] = port
-            elif protocol == 'ss':
-                # ss://BASE64(method:password)@server:port
-                if '@' in main_part:
-                    credentials_part, server_part = main_part.split('@', 1)
-                    server, port = server_part.split(':')
-                    fingerprint_parts['creds'] = credentials_part
-                    fingerprint_parts['server'] = server
-                    fingerprint_parts['port'] = port
-                else: # ss://BASE64(method:password:server:port)
-                    decoded = base64_decode(main_part)
-                    parts = decoded.split(':')
-                    fingerprint_parts['creds'] = base64_encode(f"{parts[0]}:{parts[1]}")
-                    fingerprint_parts['server'] = parts[2]
-                    fingerprint_parts['port'] = parts[3]
-            elif protocol in ['hy2', 'hysteria2']:
-                password, server_info = main_part.split('@', 1)
-                server, port = server_info.split('?')[0].split(':')
-                fingerprint_parts['id'] = password
-                fingerprint_parts['server'] = server
-                fingerprint_parts['port'] = port
-            else:
-                return None # 不支持的协议
-
-            return fingerprint_parts
-        except:
-            return None
+        """将任何分享链接解析为包含核心指纹的 Node"""
+        return parse_share_link(link)
 
-    def deduplicate_nodes(self, nodes):
-        """【核心】基于指纹的智能去重"""
-        print(f"\n--- Step 2: Performing advanced deduplication on {len(nodes)} nodes ---")
-        unique_nodes_dict = {} # { 'fingerprint': 'node_link' }
-        
-        for node_link in nodes:
-            parsed = self.parse_share_link(node_link)
-            if not parsed: continue # 跳过解析失败的
+    def node_key(self, node):
+        """去重用的键；关闭 deduplicate 时只合并完全相同的链接"""
+        return node.fingerprint if self.deduplicate else (node.link,)
+
+    def dedupe_resolved(self, links):
+        """
+        把各节点的服务器解析为 IP，按 (协议, IP, 端口, 凭据) 再去重一次，
+        同一个入口以不同域名或 IP 发布时只保留排在最前面的链接。
+        """
+        nodes = [parse_share_link(link) for link in links]
+        addresses = self.resolver.resolve_all(node.server for node in nodes if node)
+        self.resolver.save()
+        kept, seen = [], set()
+        for link, node in zip(links, nodes):
+            if node:
+                key = node.fingerprint
+                key = (key[0], addresses.get(node.server) or node.server) + key[2:]
+                if key in seen: continue
+                seen.add(key)
+            kept.append(link)
+        return kept
+
+    def fingerprint_entries(self, nodes):
+        """返回 [(指纹, 链接)]，跳过解析失败的链接，供增量合并使用"""
+        return [(self.node_key(node), node.link) for node in self.map_parallel(parse_share_link, nodes) if node]
+
+    def map_parallel(self, func, items, chunk_size=5000):
+        """
+        按顺序产出 func(item)。items 不少于 parse_threshold 个时分块交给进程池，
+        结果按块的原顺序合并，与串行处理的输出完全相同；小源直接在本进程处理。
+        同时提交的块不超过 2 倍的 parse_workers，读取一块结果后才提交下一块。
+        """
+        iterator = iter(items)
+        if self.parse_workers <= 0:
+            for item in iterator: yield func(item)
+            return
+        head = list(islice(iterator, self.parse_threshold))
+        if len(head) < self.parse_threshold:
+            for item in head: yield func(item)
+            return
+        if self.parse_pool is None:
+            self.parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=pool_context())
+        print(f"  -> Large source, parsing in {self.parse_workers} processes...")
+        chunks = chain(
+            (head[i:i + chunk_size] for i in range(0, len(head), chunk_size)),
+            iter(lambda: list(islice(iterator, chunk_size)), [])
+        )
+        work = partial(map_each, func)
+        pending = deque(self.parse_pool.submit(work, chunk) for chunk in islice(chunks, self.parse_workers * 2))
+        while pending:
+            results = pending.popleft().result()
+            for chunk in islice(chunks, 1):
+                pending.append(self.parse_pool.submit(work, chunk))
+            yield from results
 
-            # 构建一个稳定、唯一的指纹
-            fingerprint = f"{parsed.get('protocol')}-{parsed.get('server')}-{parsed.get('port')}-{parsed.get('id')}"
+    def add_unique_nodes(self, unique_nodes_dict, nodes, rank=0):
+        """
+        在线去重：把 nodes 中的节点加入 unique_nodes_dict { 指纹: (rank, Node) }，返回新增的指纹数量。
+        rank 为源在列表中的位置，同一指纹保留 rank 最小的源中第一次出现的节点，
+        与源的下载完成顺序无关，结果和按列表顺序逐个处理时相同。
+        """
+        added = 0
+        for node in self.map_parallel(parse_share_link, nodes):
+            if not node: continue # 跳过解析失败的
 
-            # 如果指纹还没出现过，就添加这个节点
-            if fingerprint not in unique_nodes_dict:
-                unique_nodes_dict[fingerprint] = node_link
+            fingerprint = self.node_key(node)
+            kept = unique_nodes_dict.get(fingerprint)
+            if kept is None:
+                added += 1
+            elif kept[0] <= rank:
+                continue
+            unique_nodes_dict[fingerprint] = (rank, node)
+        return added
 
-        final_nodes = list(unique_nodes_dict.values())
+    def deduplicate_nodes(self, nodes):
+        """【核心】基于指纹的智能去重，返回保留下来的 Node 列表"""
+        print(f"\n--- Step 2: Performing advanced deduplication on {len(nodes)} nodes ---")
+        unique_nodes_dict = {} # { (protocol, server, port, credential): (0, Node) }
+        self.add_unique_nodes(unique_nodes_dict, nodes)
+        final_nodes = [node for _, node in unique_nodes_dict.values()]
         removed_count = len(nodes) - len(final_nodes)
         print(f"Deduplication complete. Removed {removed_count} duplicate nodes.")
         return final_nodes
 
+    def carry_forward(self, item, keep_nodes=True):
+        """本次没有下载的源：保留它的下载缓存，增量模式下沿用上次的解析结果"""
+        if self.cache:
+            self.cache.touched.add(item.get('url'))
+        key = str(item.get('id'))
+        if keep_nodes and self.state and key in self.state.old_sources:
+            self.state.keep_source(key)
+
+    def winner_sources(self, unique_nodes_dict, url_list):
+        """{ 去重后保留的链接: 提供它的源 id }，用于统计各源去重后的贡献"""
+        if self.state:
+            winners, seen = {}, set()
+            for key in self.state.order:
+                for fp, link in self.state.sources[key]['nodes']:
+                    if fp in seen: continue
+                    seen.add(fp)
+                    winners[link] = key
+            return winners
+        keys = [str(item.get('id')) for item in url_list]
+        return {node.link: keys[rank] for rank, node in unique_nodes_dict.values()}
+
     def clash_to_share_link(self, proxy):
-        # ... (这个函数保持不变)
-        try:
-            protocol = proxy.get('type')
-            if not protocol: return None
-            remarks = proxy.get('name', '')
-            remarks_encoded = urllib.parse.quote(remarks)
-            if protocol == 'vmess':
-                vmess_config = {"v": "2", "ps": remarks, "add": proxy.get('server', ''), "port": proxy.get('port', ''), "id": proxy.get('uuid', ''), "aid": proxy.get('alterId', 0), "scy": proxy.get('cipher', 'auto'), "net": proxy.get('network', 'tcp'), "type": "none", "host": "", "path": "", "tls": "", "sni": ""}
-                if vmess_config['net'] == 'ws':
-                    ws_opts = proxy.get('ws-opts', {})
-                    vmess_config['host'] = ws_opts.get('headers', {}).get('Host', '')
-                    vmess_config['path'] = ws_opts.get('path', '/')
-                if proxy.get('tls'):
-                    vmess_config['tls'] = 'tls'
-                    vmess_config['sni'] = proxy.get('sni', vmess_config['host'])
-                return f"vmess://{base64_encode(json.dumps(vmess_config, separators=(',', ':')))}"
-            elif protocol == 'vless':
-                server, port, uuid = proxy.get('server'), proxy.get('port'), proxy.get('uuid')
-                if not all([server, port, uuid]): return None
-                params = {'type': proxy.get('network', 'tcp'), 'security': 'tls' if proxy.get('tls') else 'none'}
-                if params['security'] == 'tls':
-                    params['sni'] = proxy.get('sni', '')
-                    if proxy.get('reality-opts'):
-                        params['security'] = 'reality'
-                        params['pbk'] = proxy['reality-opts'].get('public-key', '')
-                        params['sid'] = proxy['reality-opts'].get('short-id', '')
-                if params['type'] == 'ws':
-                    ws_opts = proxy.get('ws-opts', {})
-                    params['host'] = ws_opts.get('headers', {}).get('Host', '')
-                    params['path'] = urllib.parse.quote(ws_opts.get('path', '/'))
-                query_string = urllib.parse.urlencode(params)
-                return f"vless://{uuid}@{server}:{port}?{query_string}#{remarks_encoded}"
-            elif protocol == 'trojan':
-                server, port, password = proxy.get('server'), proxy.get('port'), proxy.get('password')
-                if not all([server, port, password]): return None
-                params = {'sni': proxy.get('sni', server)}
-                query_string = urllib.parse.urlencode(params)
-                return f"trojan://{password}@{server}:{port}?{query_string}#{remarks_encoded}"
-            elif protocol == 'ss':
-                server, port, password, cipher = proxy.get('server'), proxy.get('port'), proxy.get('password'), proxy.get('cipher')
-                if not all([server, port, password, cipher]): return None
-                creds = f"{cipher}:{password}"
-                return f"ss://{base64_encode(creds)}@{server}:{port}#{remarks_encoded}"
-            elif protocol in ['hysteria2', 'hy2']:
-                server, port, password = proxy.get('server'), proxy.get('port'), proxy.get('password') or proxy.get('auth-str')
-                if not all([server, port, password]): return None
-                params = {}
-                if proxy.get('sni'): params['sni'] = proxy.get('sni')
-                if proxy.get('insecure') or proxy.get('skip-cert-verify'): params['insecure'] = 1
-                if proxy.get('obfs'): params['obfs'] = proxy.get('obfs')
-                if proxy.get('obfs-password'): params['obfs-password'] = proxy.get('obfs-password')
-                query_string = urllib.parse.urlencode(params)
-                return f"hysteria2://{password}@{server}:{port}?{query_string}#{remarks_encoded}"
-            return None
-        except: return None
+        """将 Clash 代理字典转换为分享链接"""
+        return clash_to_share_link(proxy)
+
+    def iter_nodes(self, raw_content):
+        """从下载到的原始内容（bytes 或 str）中识别格式，逐个产出分享链接"""
+        kind, plain_text = sniff_content(raw_content)
+        del raw_content
+        if kind.startswith('base64'):
+            print("  -> Detected Base64 format, decoded.")
+        else:
+            print("  -> Detected Plain Text / YAML format.")
+        if kind.endswith('yaml'):
+            print("  -> Content appears to be YAML, parsing...")
+            proxies_in_yaml = load_clash_proxies(plain_text)
+            del plain_text
+            for share_link in self.map_parallel(clash_to_share_link, proxies_in_yaml):
+                if share_link: yield share_link
+        else:
+            yield from iter_share_links(plain_text)
 
+    def extract_nodes(self, raw_content):
+        """从下载到的原始内容中识别格式并提取所有分享链接"""
+        return list(self.iter_nodes(raw_content))
 
     def sub_merge(self):
-        # ... (数据收集部分保持不变) ...
+        """
+        流式合并：下载 → 解码 → 逐行/逐个代理解析 → 在线去重 → 排序 → 分块 Base64 写出。
+        每个源处理完即释放其内容，常驻内存的只有去重后的节点。
+        """
         url_list = self.url_list
         list_dir, merge_dir = self.list_dir, self.merge_dir
         if os.path.exists(list_dir):
             for f in os.listdir(list_dir): os.remove(os.path.join(list_dir, f))
         else:
             os.makedirs(list_dir)
-        all_nodes_raw = [] # 不再使用 set，直接用 list 收集所有链接
-        VALID_PROTOCOLS = ('vless://', 'vmess://', 'trojan://', 'ss://', 'ssr://', 'hy2://', 'hysteria2://')
-        for item in url_list:
+        unique_nodes_dict = {} # { (protocol, server, port, credential): (源的位置, Node) }
+        total_count = 0
+        positions = {str(item.get('id')): index for index, item in enumerate(url_list)}
+        fetch_list, skipped = self.scores.schedule(url_list) if self.scores else (url_list, [])
+        for item, reason in skipped:
+            print(f"Skipping [ID: {item.get('id')}] {item.get('remarks')}: {reason}")
+            # 退避中的失败源与下载失败时一样不再提供节点，暂停的无贡献源沿用上次的结果
+            self.carry_forward(item, not self.scores.sources[str(item.get('id'))]['failures'])
+        budget = self.scores.settings['budget'] if self.scores else 0
+        processed, source_nodes = set(), {}
+        print(f"Fetching {len(fetch_list)} sources concurrently...\n")
+        stage_wall, stage_cpu = time.perf_counter(), time.process_time()
+        # 按得分顺序提交下载，到达预算后不再发起新的下载，尚未完成的（得分最低的）被取消
+        deadline = time.monotonic() + budget if budget else None
+        results = iter_fetch(fetch_list, self.fetch_config, self.cache, self.archive, deadline)
+        for result in results:
+            item = result['item']
             item_url, item_id, item_remarks = item.get('url'), item.get('id'), item.get('remarks')
-            if not item_url: continue
-            print(f"Processing [ID: {item_id}] {item_remarks} from {item_url}")
+            processed.add(str(item_id))
+            print(f"Processing [ID: {item_id}] {item_remarks} from {item_url} ({result['elapsed']:.2f}s)")
+            parse_start, node_count = time.perf_counter(), 0
+            stats = {'id': item_id, 'url': item_url, 'latency': round(result['elapsed'], 3), 'status': result['status'],
+                     'bytes': len(result['body']), 'error_class': result.get('error_class'), 'reused': False}
             try:
-                response = requests.get(item_url, timeout=15)
-                response.raise_for_status()
-                raw_content = response.text.strip()
+                if result['error']: raise ValueError(result['error'])
+                raw_content = result.pop('body').strip()
                 if not raw_content: raise ValueError("Downloaded content is empty.")
-                found_nodes = []
-                plain_text = ""
-                if is_base64(raw_content):
-                    print("  -> Detected Base64 format, decoding...")
-                    plain_text = base64_decode(raw_content)
+                source_key = str(item_id)
+                # 过滤规则变化时，增量状态中该源的结果也要重新计算
+                source_hash = result.get('hash') and f"{result['hash']}:{self.remark_filter.signature}:{int(self.deduplicate)}"
+                if self.state and self.state.is_unchanged(source_key, source_hash):
+                    node_count = self.state.keep_source(source_key)
+                    stats['reused'] = True
+                    print(f"  -> Source unchanged since last run, carrying forward {node_count} nodes.")
+                    continue
+                cached_nodes = None
+                if self.cache and result['unchanged']:
+                    cached_nodes = self.cache.load_nodes(item_url, result['hash'])
+                if cached_nodes is not None:
+                    print("  -> Source unchanged since last run, reusing cached nodes.")
+                    stats['reused'] = True
+                    found_nodes = cached_nodes
+                elif self.cache or self.state:
+                    # 缓存和增量状态需要保存该源的完整链接列表
+                    found_nodes = self.extract_nodes(raw_content)
+                    if self.cache: self.cache.save_nodes(item_url, result['hash'], found_nodes)
                 else:
-                    print("  -> Detected Plain Text / YAML format.")
-                    plain_text = raw_content
-                if 'proxies:' in plain_text:
-                    print("  -> Content appears to be YAML, parsing...")
-                    data = yaml.safe_load(plain_text)
-                    proxies_in_yaml = data.get('proxies', [])
-                    if proxies_in_yaml:
-                        for proxy_dict in proxies_in_yaml:
-                            share_link = self.clash_to_share_link(proxy_dict)
-                            if share_link: found_nodes.append(share_link)
+                    found_nodes = self.iter_nodes(raw_content)
+                del raw_content
+                if self.remark_filter:
+                    # 缓存中保存的是过滤前的链接，过滤与解析在同一次遍历中完成
+                    found_nodes = self.remark_filter.filter_links(found_nodes)
+                if self.state:
+                    entries = self.fingerprint_entries(found_nodes)
+                    self.state.update_source(source_key, source_hash, entries)
+                    node_count = len(entries)
                 else:
-                    found_nodes = [line.strip() for line in plain_text.splitlines() if line.strip().lower().startswith(VALID_PROTOCOLS)]
-                if found_nodes:
-                    all_nodes_raw.extend(found_nodes)
-                    print(f'  -> Success! Extracted {len(found_nodes)} valid node links.')
+                    counter = CountingIterator(found_nodes)
+                    self.add_unique_nodes(unique_nodes_dict, counter, positions[source_key])
+                    node_count = counter.count
+                    total_count += node_count
+                if node_count:
+                    print(f'  -> Success! Extracted {node_count} valid node links.')
                 else:
                     print(f"  -> ⭐⭐ Warning: No valid node links found.")
             except Exception as e:
+                stats['error_class'] = stats['error_class'] or e.__class__.__name__
                 print(f"  -> ⭐⭐ Failed! Reason: {e}")
             finally:
+                stats.update(nodes=node_count, parse_seconds=round(time.perf_counter() - parse_start, 4))
+                metrics.source('merge', **stats)
+                if self.scores:
+                    self.scores.record_fetch(str(item_id), not stats['error_class'], stats['latency'], node_count, stats['error_class'])
+                    if not stats['error_class']: source_nodes[str(item_id)] = node_count
                 print()
+        results.close()
+        # 超出时间预算、没有下载完的源沿用上次的结果
+        cut = [item for item in fetch_list if str(item.get('id')) not in processed]
+        if cut:
+            print(f"Time budget of {budget:g}s used up, {len(cut)} lower-priority sources not fetched: ID{', ID'.join(str(item.get('id')) for item in cut)}\n")
+            for item in cut:
+                # 下次优先下载；连续被挤掉超过 max_carry 次的源不再沿用旧节点
+                keep_nodes = self.scores.record_cut(str(item.get('id')))
+                if not keep_nodes:
+                    print(f"[ID: {item.get('id')}] not fetched in {self.scores.sources[str(item.get('id'))]['cut']} runs in a row, dropping its carried-forward nodes.")
+                self.carry_forward(item, keep_nodes)
+        metrics.add_time('merge.fetch_parse', time.perf_counter() - stage_wall, time.process_time() - stage_cpu)
 
-        if not all_nodes_raw:
-            print('⭐⭐ Merging failed: No nodes collected.')
-            return
-        
-        # 【核心改变】在合并前，调用智能去重函数
-        unique_nodes = self.deduplicate_nodes(all_nodes_raw)
-        
-        final_node_count = len(unique_nodes)
+        if self.cache: self.cache.save()
+        if self.parse_pool:
+            self.parse_pool.shutdown()
+            self.parse_pool = None
+
+        if self.state:
+            # 下载顺序按得分排列，去重时仍按源在列表中的顺序决定保留哪个链接
+            self.state.order.sort(key=lambda key: positions.get(key, len(positions)))
+        if self.scores:
+            self.scores.record_contribution(self.winner_sources(unique_nodes_dict, url_list), source_nodes)
+            self.scores.save()
+
+        if self.state:
+            # 增量模式：只对变化的源打补丁
+            print(f"\n--- Step 2: Patching merged output from {len(self.state.changed)} changed sources ---")
+            with metrics.stage('merge.finalize'):
+                sorted_nodes, added_count, removed_count = self.state.finalize()
+            print(f"Incremental merge complete. Added {added_count}, removed {removed_count} nodes.")
+            if not sorted_nodes:
+                print('⭐⭐ Merging failed: No nodes collected.')
+                return
+            self.state.save()
+        else:
+            if not unique_nodes_dict:
+                print('⭐⭐ Merging failed: No nodes collected.')
+                return
+            # 去重已在收集时在线完成
+            print(f"\n--- Step 2: Advanced deduplication on {total_count} nodes ---")
+            print(f"Deduplication complete. Removed {total_count - len(unique_nodes_dict)} duplicate nodes.")
+            with metrics.stage('merge.finalize'):
+                sorted_nodes = sorted(node.link for _, node in unique_nodes_dict.values())
+            unique_nodes_dict.clear()
+            metrics.count('merge.nodes_collected', total_count)
+
+        if self.resolver:
+            print(f"Resolving servers of {len(sorted_nodes)} nodes for endpoint deduplication...")
+            with metrics.stage('merge.resolve_dedupe'):
+                resolved_nodes = self.dedupe_resolved(sorted_nodes)
+            print(f"Endpoint deduplication removed {len(sorted_nodes) - len(resolved_nodes)} nodes sharing an IP.")
+            sorted_nodes = resolved_nodes
+
+        final_node_count = len(sorted_nodes)
+        metrics.count('merge.nodes_unique', final_node_count)
         print(f'\nTotal unique node links after deduplication: {final_node_count}')
-        
-        print('Packaging all collected nodes into a Base64 subscription...')
-        final_plain_text = '\n'.join(sorted(unique_nodes))
-        final_b64_content = base64_encode(final_plain_text)
-        print(f"  -> Packaging successful.")
+
+        print('Writing plain, Base64 and Clash outputs...')
         merge_path_final = f'{self.merge_dir}/sub_merge_base64.txt'
-        with open(merge_path_final, 'w', encoding='utf-8') as file:
-            file.write(final_b64_content)
+        with metrics.stage('merge.emit'):
+            clash_count = emit_outputs(self.merge_dir, sorted_nodes, self.clash_config_file)
+        print(f"  -> Packaging successful. {clash_count} nodes written to Clash outputs.")
         print(f'\nDone! Output merged nodes to {merge_path_final}.')
 
 
@@ -267,6 +425,6 @@ class merge():
 
 if __name__ == '__main__':
     # ... (__main__ 保持不变)
-    file_dir = { 'list_dir': './sub/list/', 'list_file': './sub/sub_list.json', 'merge_dir': './sub/', 'update_dir': './sub/update/', 'readme_file': './README.md', 'share_file': './sub/share.txt'}
+    file_dir = { 'list_dir': './sub/list/', 'list_file': './sub/sub_list.json', 'merge_dir': './sub/', 'update_dir': './sub/update/', 'cache_dir': './sub/cache/', 'readme_file': './README.md', 'share_file': './sub/share.txt'}
     format_config = {}
     merge(file_dir, format_config)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# utils/sub_metrics.py 运行指标：各阶段耗时、各源下载情况、内存峰值，运行结束写出 JSON 报告
+
+import json, os, time, threading
+from contextlib import contextmanager
+
+try:
+    import resource # Windows 上没有，此时不记录 RSS
+except ImportError:
+    resource = None
+
+def peak_rss_kb(who='self'):
+    """本进程（或已结束的子进程中最大的）常驻内存峰值，单位 KB"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # macOS 上 ru_maxrss 的单位是字节
+    return usage.ru_maxrss // 1024 if os.uname().sysname == 'Darwin' else usage.ru_maxrss
+
+class run_report():
+    """
+    stages   { 阶段名: {'calls', 'wall', 'cpu', 'peak_rss_kb'} }，同名阶段多次调用时累加
+    sources  { 阶段名: [ {'id', 'url', 'latency', 'bytes', 'nodes', 'error_class', ...} ] }
+    counters { 名称: 数值 }
+    所有方法都可以在多个线程中调用。
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.sources = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.profile_mode = None
+        self.profiler = None
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add_time(self, name, wall, cpu=0.0):
+        with self.lock:
+            entry = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            entry['calls'] += 1
+            entry['wall'] = round(entry['wall'] + wall, 4)
+            entry['cpu'] = round(entry['cpu'] + cpu, 4)
+            entry['peak_rss_kb'] = peak_rss_kb()
+
+    def source(self, stage, **fields):
+        with self.lock:
+            self.sources.setdefault(stage, []).append(fields)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def start_profile(self, mode):
+        """mode 为 'cprofile' 或 'tracemalloc'，其他值不做任何事"""
+        mode = (mode or '').strip().lower()
+        if mode == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif mode == 'tracemalloc':
+            import tracemalloc
+            tracemalloc.start(10)
+        else:
+            return
+        self.profile_mode = mode
+
+    def stop_profile(self, report_file):
+        """停止分析，cProfile 的完整数据另存为 <报告名>.pstats，摘要放进报告"""
+        if self.profile_mode == 'cprofile':
+            import pstats, io
+            self.profiler.disable()
+            self.profiler.dump_stats(os.path.splitext(report_file)[0] + '.pstats')
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(30)
+            summary = stream.getvalue().splitlines()
+        elif self.profile_mode == 'tracemalloc':
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:30]
+            tracemalloc.stop()
+            summary = {'current_kb': current // 1024, 'peak_kb': peak // 1024, 'top': [str(stat) for stat in top]}
+        else:
+            return None
+        self.profile_mode = None
+        return summary
+
+    def write(self, report_file):
+        profile = self.stop_profile(report_file)
+        with self.lock:
+            report = {
+                'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                'duration': round(time.time() - self.started, 3),
+                'peak_rss_kb': peak_rss_kb(),
+                'children_peak_rss_kb': peak_rss_kb('children'),
+                'stages': self.stages,
+                'sources': self.sources,
+                'counters': self.counters
+            }
+        if profile is not None:
+            report['profile'] = profile
+        os.makedirs(os.path.dirname(report_file) or '.', exist_ok=True)
+        temp_file = report_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        os.replace(temp_file, report_file)
+        return report
+
+    def append_history(self, report, history_file, keep=200):
+        """
+        把报告的摘要（各阶段耗时、内存峰值、计数、各阶段源的成功/失败数）作为一行追加到 history_file，
+        只保留最近 keep 次运行；report_file 每次被覆盖，趋势从这里看。
+        """
+        summary = {
+            'started': report['started'], 'duration': report['duration'], 'peak_rss_kb': report['peak_rss_kb'],
+            'stages': {name: entry['wall'] for name, entry in report['stages'].items()},
+            'sources': {stage: {'total': len(items), 'failed': sum(1 for item in items if item.get('error_class'))}
+                        for stage, items in report['sources'].items()},
+            'counters': report['counters']
+        }
+        lines = []
+        if os.path.exists(history_file):
+            with open(history_file, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        lines = lines[-(keep - 1):] if keep > 1 else []
+        lines.append(json.dumps(summary, ensure_ascii=False, separators=(',', ':')))
+        os.makedirs(os.path.dirname(history_file) or '.', exist_ok=True)
+        temp_file = history_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_file, history_file)
+
+# 整个进程共用一份报告
+metrics = run_report()
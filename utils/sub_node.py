@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# utils/sub_node.py 紧凑的节点结构与分享链接解析
+
+import json, sys, base64
+import urllib.parse
+
+def base64_decode(s):
+    try:
+        s = s.strip()
+        missing_padding = len(s) % 4
+        if missing_padding: s += '=' * (4 - missing_padding)
+        return base64.b64decode(s).decode('utf-8', 'ignore')
+    except: return ""
+
+def base64_encode(s):
+    return base64.b64encode(s.encode('utf-8')).decode('ascii')
+
+class Node():
+    """
+    一个节点只保留去重需要的字段和原始链接。
+    使用 __slots__ 不创建实例字典；协议名和地址用 sys.intern 驻留，
+    大量节点共用同一个服务器地址时只保存一份字符串。
+    """
+    __slots__ = ('protocol', 'server', 'port', 'credential', 'link')
+
+    def __init__(self, protocol, server, port, credential, link):
+        self.protocol = sys.intern(protocol)
+        self.server = sys.intern(str(server))
+        self.port = str(port) # vmess 的端口可能是数字，统一成字符串
+        self.credential = credential
+        self.link = link
+
+    @property
+    def fingerprint(self):
+        """可哈希的去重指纹；ss 同一端口只会有一个密码，沿用只按地址去重的规则"""
+        if self.protocol == 'ss':
+            return (self.protocol, self.server, self.port, None)
+        return (self.protocol, self.server, self.port, self.credential)
+
+    def __repr__(self):
+        return f'Node({self.protocol}://{self.server}:{self.port})'
+
+def parse_share_link(link):
+    """将任何分享链接解析为 Node，不支持或解析失败时返回 None"""
+    try:
+        protocol, rest = link.split("://", 1)
+        # 移除 #remarks 部分
+        main_part = rest.split('#')[0]
+
+        if protocol == 'vmess':
+            config = json.loads(base64_decode(main_part))
+            return Node(protocol, config.get('add', ''), config.get('port', ''), config.get('id', ''), link)
+        elif protocol in ['vless', 'trojan']:
+            user_info, server_info = main_part.split('@', 1)
+            server, port = server_info.split('?')[0].split(':')
+            return Node(protocol, server, port, user_info, link)
+        elif protocol == 'ss':
+            # ss://BASE64(method:password)@server:port
+            if '@' in main_part:
+                credentials_part, server_part = main_part.split('@', 1)
+                server, port = server_part.split(':')
+                return Node(protocol, server, port, credentials_part, link)
+            else: # ss://BASE64(method:password:server:port)
+                decoded = base64_decode(main_part)
+                parts = decoded.split(':')
+                return Node(protocol, parts[2], parts[3], base64_encode(f"{parts[0]}:{parts[1]}"), link)
+        elif protocol in ['hy2', 'hysteria2']:
+            password, server_info = main_part.split('@', 1)
+            server, port = server_info.split('?')[0].split(':')
+            return Node(protocol, server, port, password, link)
+        return None # 不支持的协议
+    except:
+        return None
+
+def clash_to_share_link(proxy):
+    """将 Clash 代理字典转换为分享链接，不支持或字段缺失时返回 None"""
+    try:
+        protocol = proxy.get('type')
+        if not protocol: return None
+        remarks = proxy.get('name', '')
+        remarks_encoded = urllib.parse.quote(remarks)
+        if protocol == 'vmess':
+            vmess_config = {"v": "2", "ps": remarks, "add": proxy.get('server', ''), "port": proxy.get('port', ''), "id": proxy.get('uuid', ''), "aid": proxy.get('alterId', 0), "scy": proxy.get('cipher', 'auto'), "net": proxy.get('network', 'tcp'), "type": "none", "host": "", "path": "", "tls": "", "sni": ""}
+            if vmess_config['net'] == 'ws':
+                ws_opts = proxy.get('ws-opts', {})
+                vmess_config['host'] = ws_opts.get('headers', {}).get('Host', '')
+                vmess_config['path'] = ws_opts.get('path', '/')
+            if proxy.get('tls'):
+                vmess_config['tls'] = 'tls'
+                vmess_config['sni'] = proxy.get('sni', vmess_config['host'])
+            return f"vmess://{base64_encode(json.dumps(vmess_config, separators=(',', ':')))}"
+        elif protocol == 'vless':
+            server, port, uuid = proxy.get('server'), proxy.get('port'), proxy.get('uuid')
+            if not all([server, port, uuid]): return None
+            params = {'type': proxy.get('network', 'tcp'), 'security': 'tls' if proxy.get('tls') else 'none'}
+            if params['security'] == 'tls':
+                params['sni'] = proxy.get('sni', '')
+                if proxy.get('reality-opts'):
+                    params['security'] = 'reality'
+                    params['pbk'] = proxy['reality-opts'].get('public-key', '')
+                    params['sid'] = proxy['reality-opts'].get('short-id', '')
+            if params['type'] == 'ws':
+                ws_opts = proxy.get('ws-opts', {})
+                params['host'] = ws_opts.get('headers', {}).get('Host', '')
+                params['path'] = urllib.parse.quote(ws_opts.get('path', '/'))
+            query_string = urllib.parse.urlencode(params)
+            return f"vless://{uuid}@{server}:{port}?{query_string}#{remarks_encoded}"
+        elif protocol == 'trojan':
+            server, port, password = proxy.get('server'), proxy.get('port'), proxy.get('password')
+            if not all([server, port, password]): return None
+            params = {'sni': proxy.get('sni', server)}
+            query_string = urllib.parse.urlencode(params)
+            return f"trojan://{password}@{server}:{port}?{query_string}#{remarks_encoded}"
+        elif protocol == 'ss':
+            server, port, password, cipher = proxy.get('server'), proxy.get('port'), proxy.get('password'), proxy.get('cipher')
+            if not all([server, port, password, cipher]): return None
+            creds = f"{cipher}:{password}"
+            return f"ss://{base64_encode(creds)}@{server}:{port}#{remarks_encoded}"
+        elif protocol in ['hysteria2', 'hy2']:
+            server, port, password = proxy.get('server'), proxy.get('port'), proxy.get('password') or proxy.get('auth-str')
+            if not all([server, port, password]): return None
+            params = {}
+            if proxy.get('sni'): params['sni'] = proxy.get('sni')
+            if proxy.get('insecure') or proxy.get('skip-cert-verify'): params['insecure'] = 1
+            if proxy.get('obfs'): params['obfs'] = proxy.get('obfs')
+            if proxy.get('obfs-password'): params['obfs-password'] = proxy.get('obfs-password')
+            query_string = urllib.parse.urlencode(params)
+            return f"hysteria2://{password}@{server}:{port}?{query_string}#{remarks_encoded}"
+        return None
+    except: return None
+
+def map_each(func, items):
+    """进程池的工作函数：对一块数据逐个调用 func，保持顺序返回"""
+    return [func(item) for item in items]
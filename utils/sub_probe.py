@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# utils/sub_probe.py 测速前的可达性预筛：并发建立 TCP 连接，必要时完成一次 TLS 握手
+
+import asyncio, ssl
+
+from sub_emit import share_link_to_clash
+from sub_node import parse_share_link
+
+DEFAULT_PROBE_CONFIG = {'concurrency': 256, 'timeout': 2, 'tls': True}
+# hysteria2 走 UDP (QUIC)，无法用 TCP 判断，直接保留交给测速
+UDP_PROTOCOLS = ('hysteria2', 'hy2')
+
+def probe_settings(probe_config={}):
+    settings = dict(DEFAULT_PROBE_CONFIG)
+    settings.update({key: value for key, value in probe_config.items() if value not in (None, '')})
+    return {
+        'concurrency': int(settings['concurrency']),
+        'timeout': float(settings['timeout']),
+        'tls': str(settings['tls']).lower() == 'true'
+    }
+
+def probe_target(link):
+    """
+    返回 (host, port, sni)，sni 为 None 时只检查 TCP；
+    UDP 协议返回 'skip'，无法解析返回 None。
+    """
+    proxy = share_link_to_clash(link)
+    if proxy:
+        if proxy['type'] in UDP_PROTOCOLS:
+            return 'skip'
+        sni = None
+        if proxy['type'] == 'trojan' or proxy.get('tls'):
+            sni = proxy.get('sni') or proxy.get('servername') or proxy['server']
+        return proxy['server'], int(proxy['port']), sni
+    node = parse_share_link(link)
+    if not node:
+        return None
+    if node.protocol in UDP_PROTOCOLS:
+        return 'skip'
+    try:
+        return node.server, int(node.port), None
+    except ValueError:
+        return None
+
+def tls_context():
+    # 只确认对端能完成握手，不校验证书（大量节点使用自签名证书或 Reality 伪装）
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+async def check_one(target, timeout, context=None):
+    """连接成功（以及需要时 TLS 握手成功）返回 True，任何异常或超时返回 False"""
+    host, port, sni = target
+    writer = None
+    try:
+        if sni and context:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=context, server_hostname=sni), timeout)
+        else:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        return True
+    except Exception:
+        return False
+    finally:
+        if writer:
+            writer.close()
+            try:
+                await asyncio.wait_for(writer.wait_closed(), 1)
+            except Exception:
+                pass
+
+async def check_all(targets, settings):
+    semaphore = asyncio.Semaphore(settings['concurrency'])
+    context = tls_context() if settings['tls'] else None
+
+    async def bounded(target):
+        async with semaphore:
+            return target, await check_one(target, settings['timeout'], context)
+
+    return dict(await asyncio.gather(*(bounded(target) for target in targets)))
+
+def reachable_links(links, probe_config={}):
+    """
+    按原顺序返回可达的链接。相同的 (host, port, sni) 只探测一次；
+    无法解析的链接丢弃，UDP 协议的链接原样保留。
+    """
+    settings = probe_settings(probe_config)
+    targets = [(link, probe_target(link)) for link in links]
+    unique_targets = {target for _, target in targets if target and target != 'skip'}
+    results = asyncio.run(check_all(unique_targets, settings)) if unique_targets else {}
+    return [link for link, target in targets if target == 'skip' or results.get(target)]
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# utils/sub_replay.py 下载录制与回放：把一次运行的所有 HTTP 响应存成存档，之后离线重放
+"""
+[fetch] 中 mode=record 时，update / merge / geo 阶段的每个请求照常访问网络，
+同时把状态码、响应头、内容和耗时写入 archive_file；mode=replay 时不访问网络，直接从存档返回。
+replay_latency 为回放时注入的延迟倍数：0 立即返回，1 按录制时的耗时等待。
+
+存档是一个 zip 文件:
+    index.json          {'version', 'recorded', 'entries': { url: [ 响应, ... ] }}
+                        响应为 {'status', 'headers', 'body', 'elapsed', 'error', 'error_class'}，body 为内容的 sha1
+    bodies/<sha1>       响应内容，相同的内容只存一份
+同一链接被请求多次时按顺序回放各次的响应，用完后重复最后一次。
+"""
+
+import asyncio, hashlib, io, json, os, threading, time, zipfile
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+ARCHIVE_VERSION = 1
+
+class fetch_archive():
+    def __init__(self, archive_file, mode='replay', latency=0.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'Unknown fetch mode: {mode}')
+        self.archive_file = archive_file
+        self.mode = mode
+        self.latency = float(latency or 0)
+        self.lock = threading.Lock()
+        self.closed = False
+        self.cursors = {}
+        if mode == 'record':
+            os.makedirs(os.path.dirname(archive_file) or '.', exist_ok=True)
+            self.entries = {}
+            self.bodies = set()
+            self.zip = zipfile.ZipFile(archive_file + '.tmp', 'w', zipfile.ZIP_DEFLATED)
+        else:
+            self.zip = zipfile.ZipFile(archive_file, 'r')
+            index = json.loads(self.zip.read('index.json'))
+            if index.get('version') != ARCHIVE_VERSION:
+                raise ValueError(f'Unsupported archive version: {index.get("version")}')
+            self.entries = index['entries']
+            print(f'Replaying {sum(map(len, self.entries.values()))} recorded responses from {archive_file}.')
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def record(self, url, status, headers, body, elapsed, error=None, error_class=None):
+        """保存一次响应；出错的请求同样保存，回放时得到相同的错误"""
+        digest = None
+        if body:
+            digest = hashlib.sha1(body).hexdigest()
+        with self.lock:
+            if self.closed: return # 存档写完后才结束的请求不再记录
+            if digest and digest not in self.bodies:
+                self.zip.writestr(f'bodies/{digest}', body)
+                self.bodies.add(digest)
+            self.entries.setdefault(url, []).append({
+                'status': status, 'headers': dict(headers or {}), 'body': digest,
+                'elapsed': round(elapsed, 4), 'error': error, 'error_class': error_class
+            })
+
+    def lookup(self, url, request_headers={}):
+        """
+        取出 url 的下一个录制响应（dict，'body' 为 bytes），没有录制时返回 None。
+        请求带的 If-None-Match / If-Modified-Since 与录制的响应头一致时返回 304，与真实服务器相同。
+        """
+        with self.lock:
+            responses = None if self.closed else self.entries.get(url)
+            if not responses:
+                return None
+            cursor = self.cursors.get(url, 0)
+            self.cursors[url] = cursor + 1
+            entry = dict(responses[min(cursor, len(responses) - 1)])
+            headers = CaseInsensitiveDict(entry['headers'])
+            conditional = request_headers.get('If-None-Match') or request_headers.get('If-Modified-Since')
+            if entry['status'] == 200 and conditional and conditional in (headers.get('ETag'), headers.get('Last-Modified')):
+                entry.update(status=304, body=b'')
+            else:
+                entry['body'] = self.zip.read(f'bodies/{entry["body"]}') if entry['body'] else b''
+        return entry
+
+    def delay(self, entry):
+        return entry['elapsed'] * self.latency if entry else 0.0
+
+    def mount(self, session):
+        """让 requests 会话的所有请求经过存档"""
+        adapter = replay_adapter(self) if self.replaying else record_adapter(self, pool_connections=16, pool_maxsize=32)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def close(self):
+        if self.mode == 'record':
+            with self.lock:
+                self.closed = True
+                self.zip.writestr('index.json', json.dumps({
+                    'version': ARCHIVE_VERSION, 'recorded': int(time.time()), 'entries': self.entries
+                }, ensure_ascii=False))
+                self.zip.close()
+                os.replace(self.archive_file + '.tmp', self.archive_file)
+            print(f'Recorded {sum(map(len, self.entries.values()))} responses to {self.archive_file}.')
+        else:
+            with self.lock:
+                self.closed = True
+                self.zip.close()
+
+class record_adapter(HTTPAdapter):
+    """照常发送请求，读完整个响应后存入存档；流式读取的调用方随后从内存中读取"""
+    def __init__(self, archive, **kwargs):
+        super().__init__(**kwargs)
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        try:
+            response = super().send(request, **kwargs)
+            response.content
+        except Exception as e:
+            self.archive.record(request.url, None, {}, b'', time.monotonic() - start, str(e) or e.__class__.__name__, e.__class__.__name__)
+            raise
+        self.archive.record(request.url, response.status_code, response.headers, response.content, time.monotonic() - start)
+        return response
+
+class replay_adapter(BaseAdapter):
+    """从存档构造 requests.Response，不访问网络"""
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        entry = self.archive.lookup(request.url, request.headers)
+        if entry is None:
+            raise requests.exceptions.ConnectionError(f'Not in fetch archive: {request.url}', request=request)
+        if self.archive.latency:
+            time.sleep(self.archive.delay(entry))
+        if entry['status'] is None:
+            error = requests.exceptions.Timeout if 'Timeout' in (entry['error_class'] or '') else requests.exceptions.ConnectionError
+            raise error(entry['error'], request=request)
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(entry['body'])
+        response._content = entry['body']
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+async def replay_fetch(archive, result, headers={}):
+    """sub_fetch.fetch_one 的回放版本：按存档填写 result 的各字段"""
+    url = result['item']['url']
+    entry = archive.lookup(url, headers)
+    if entry is None:
+        result['error'], result['error_class'] = f'Not in fetch archive: {url}', 'NotRecorded'
+        return result
+    if archive.latency:
+        await asyncio.sleep(archive.delay(entry))
+    result['status'] = entry['status']
+    # 记录录制时的耗时，回放时 record_fetch 得到的延迟与评分和原来的运行一致，与注入的延迟无关
+    result['elapsed'] = entry['elapsed']
+    recorded = CaseInsensitiveDict(entry['headers'])
+    result['headers'] = {key: recorded[key] for key in ('ETag', 'Last-Modified') if key in recorded}
+    if entry['error'] or entry['status'] is None:
+        result['error'], result['error_class'] = entry['error'], entry['error_class']
+    elif entry['status'] >= 400:
+        # 由 requests 录制的响应没有错误信息，按 aiohttp 的 raise_for_status 补上
+        result['error'], result['error_class'] = f"{entry['status']}, url={url}", 'ClientResponseError'
+    else:
+        result['body'] = entry['body']
+    return result
+
+def open_archive(fetch_config={}):
+    """按 [fetch] 的 mode / archive_file / replay_latency 打开存档，mode 为 live 或未设置时返回 None"""
+    mode = (fetch_config.get('mode') or 'live').strip().lower()
+    if mode == 'live':
+        return None
+    return fetch_archive(fetch_config['archive_file'], mode, fetch_config.get('replay_latency') or 0)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# utils/sub_score.py 订阅源质量评分：跨运行记录各源的表现，决定下载顺序、退避和跳过
+
+import hashlib, json, os, time
+
+from sub_health import fingerprint_key
+
+DEFAULT_SCHEDULE_CONFIG = {
+    'budget': 0.0,        # merge 阶段的下载时间预算（秒），到点后不再发起新的下载，0 为不限
+    'max_failures': 3,    # 连续失败达到该次数后开始退避
+    'backoff': 21600,     # 退避的基础时长（秒），之后每多失败一次翻倍
+    'max_backoff': 604800,
+    'idle_runs': 5,       # 连续这么多次成功下载却没有贡献任何去重后节点的源暂停 backoff 秒
+    'max_carry': 3,       # 连续这么多次因时间预算没有下载的源不再沿用上次的节点
+    'alpha': 0.3          # 滑动平均中本次结果的权重
+}
+
+def link_key(link):
+    """按节点指纹取 sha1 前 12 位，测速后链接写法或备注变了也能对应到原来的源"""
+    return hashlib.sha1(fingerprint_key(link).encode('utf-8')).hexdigest()[:12]
+
+def schedule_settings(schedule_config={}):
+    settings = dict(DEFAULT_SCHEDULE_CONFIG)
+    for key, value in schedule_config.items():
+        if key in settings and str(value).strip():
+            settings[key] = type(DEFAULT_SCHEDULE_CONFIG[key])(value)
+    return settings
+
+class source_scores():
+    """
+    stats_file 内容:
+        sources  { 源 id: {'runs', 'successes', 'failures', 'idle', 'success_rate', 'latency', 'nodes',
+                           'unique', 'unique_ratio', 'pass_rate', 'skip_until', 'cut', 'last_error', 'last_run'} }
+                 success_rate / latency / nodes / unique / unique_ratio / pass_rate 为滑动平均；
+                 failures、idle、cut 为连续失败次数、连续无贡献次数、连续因时间预算没有下载的次数
+        links    { 输出节点指纹的 sha1 前 12 位: 源 id }，上次合并中每个输出节点由哪个源提供，供测速后统计通过率
+    """
+    def __init__(self, stats_file, schedule_config={}):
+        self.stats_file = stats_file
+        self.settings = schedule_settings(schedule_config)
+        self.now = time.time()
+        try:
+            with open(stats_file, 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+        except Exception:
+            stats = {}
+        self.sources = stats.get('sources', {})
+        self.links = stats.get('links', {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.stats_file) or '.', exist_ok=True)
+        temp_file = self.stats_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'sources': self.sources, 'links': self.links}, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_file, self.stats_file)
+
+    def _entry(self, key):
+        return self.sources.setdefault(key, {
+            'runs': 0, 'successes': 0, 'failures': 0, 'idle': 0, 'success_rate': 1.0, 'latency': 0.0,
+            'nodes': 0.0, 'unique': 0.0, 'unique_ratio': 1.0, 'pass_rate': None, 'skip_until': 0, 'cut': 0, 'last_error': None, 'last_run': 0
+        })
+
+    def _average(self, entry, field, value):
+        if entry[field] is None or entry['runs'] <= 1:
+            entry[field] = value
+        else:
+            entry[field] = round(entry[field] + self.settings['alpha'] * (value - entry[field]), 4)
+
+    def score(self, key):
+        """预计每秒能带来的去重后节点数，按测速通过率加权；没有记录的新源排在最前"""
+        entry = self.sources.get(key)
+        if not entry or not entry['runs']:
+            return float('inf')
+        pass_rate = 1.0 if entry['pass_rate'] is None else entry['pass_rate']
+        return entry['success_rate'] * (entry['unique'] + 1) * (0.5 + 0.5 * pass_rate) / (entry['latency'] + 1)
+
+    def schedule(self, url_list):
+        """
+        返回 (按得分从高到低排列的待下载源, [(被跳过的源, 原因)])。
+        得分相同的保持列表中的顺序；退避中的源跳过。退避期满的源排在最前面重新探测一次，
+        不会因为得分低而被时间预算挤掉；探测后仍然失败或没有贡献的再次暂停。
+        上次被时间预算挤掉的源紧随其后（挤掉次数多的在前），各源轮流下载，得分不会一直停在旧值上。
+        """
+        ready, skipped = [], []
+        for position, item in enumerate(url_list):
+            entry = self.sources.get(str(item.get('id')))
+            if entry and entry['skip_until'] > self.now:
+                reason = f"{entry['failures']} failures in a row" if entry['failures'] else f"no unique nodes in {entry['idle']} runs"
+                skipped.append((item, f"{reason}, retry after {time.strftime('%m-%d %H:%M', time.localtime(entry['skip_until']))}"))
+            else:
+                probe = bool(entry and entry['skip_until'])
+                cut = entry.get('cut', 0) if entry else 0
+                ready.append((not probe, -cut, -self.score(str(item.get('id'))), position, item))
+        ready.sort(key=lambda entry: entry[:4])
+        return [entry[-1] for entry in ready], skipped
+
+    def record_fetch(self, key, ok, latency, nodes=0, error_class=None):
+        """记录一次下载与解析的结果"""
+        settings = self.settings
+        entry = self._entry(key)
+        entry['runs'] += 1
+        entry['last_run'] = int(self.now)
+        entry['cut'] = 0
+        self._average(entry, 'success_rate', 1.0 if ok else 0.0)
+        self._average(entry, 'latency', latency)
+        if ok:
+            entry['successes'] += 1
+            entry['failures'] = 0
+            entry['last_error'] = None
+            entry['skip_until'] = 0
+            self._average(entry, 'nodes', nodes)
+        else:
+            entry['failures'] += 1
+            entry['last_error'] = error_class
+            over = entry['failures'] - settings['max_failures']
+            if over >= 0:
+                entry['skip_until'] = int(self.now + min(settings['backoff'] * 2 ** over, settings['max_backoff']))
+
+    def record_cut(self, key):
+        """记录一次因时间预算没有下载，返回是否还应沿用上次的节点"""
+        entry = self._entry(key)
+        entry['cut'] = entry.get('cut', 0) + 1
+        return entry['cut'] <= self.settings['max_carry']
+
+    def record_contribution(self, winners, nodes):
+        """
+        winners 为 { 输出链接: 提供它的源 id }（去重时保留下来的源），nodes 为 { 源 id: 本次解析出的节点数 }。
+        只统计本次成功解析的源，连续 idle_runs 次没有贡献的源暂停 backoff 秒。
+        """
+        unique = {}
+        for key in winners.values():
+            unique[key] = unique.get(key, 0) + 1
+        for key, count in nodes.items():
+            entry = self._entry(key)
+            self._average(entry, 'unique', unique.get(key, 0))
+            self._average(entry, 'unique_ratio', unique.get(key, 0) / count if count else 0.0)
+            entry['idle'] = 0 if unique.get(key) else entry['idle'] + 1
+            if entry['idle'] >= self.settings['idle_runs']:
+                entry['skip_until'] = int(self.now + self.settings['backoff'])
+        self.links = {link_key(link): key for link, key in winners.items()}
+
+    def record_speedtest(self, tested_links, passed_links):
+        """按上次合并记录的来源，统计各源节点通过测速（进入最终输出）的比例"""
+        passed = set(map(link_key, passed_links))
+        tested, hits = {}, {}
+        for link in tested_links:
+            digest = link_key(link)
+            key = self.links.get(digest)
+            if key is None: continue
+            tested[key] = tested.get(key, 0) + 1
+            if digest in passed: hits[key] = hits.get(key, 0) + 1
+        for key, count in tested.items():
+            entry = self._entry(key)
+            rate = hits.get(key, 0) / count
+            entry['pass_rate'] = rate if entry['pass_rate'] is None else round(entry['pass_rate'] + self.settings['alpha'] * (rate - entry['pass_rate']), 4)
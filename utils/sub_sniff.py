@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# utils/sub_sniff.py 订阅内容格式识别与一次性解码
+
+import binascii, re
+
+SNIFF_SIZE = 4096
+# Base64 字母表（含 URL 安全变体）、填充符和换行，前缀中出现其他字节就不是 Base64
+BASE64_PREFIX = re.compile(rb'[A-Za-z0-9+/\-_=\s]*')
+URLSAFE_TABLE = bytes.maketrans(b'-_', b'+/')
+SHARE_LINK_LINE = re.compile(r'^\s*((?i:vless|vmess|trojan|ssr?|hy2|hysteria2)://.*?)\s*$', re.M)
+
+def decode_base64_bytes(data):
+    """
+    解码标准、URL 安全、按行折叠、缺少填充的 Base64，失败返回 None。
+    全程在 bytes 上处理，不生成中间的 str。
+    """
+    data = b''.join(data.split()).translate(URLSAFE_TABLE).rstrip(b'=')
+    if not data:
+        return None
+    data += b'=' * (-len(data) % 4)
+    try:
+        return binascii.a2b_base64(data, strict_mode=True)
+    except (binascii.Error, ValueError):
+        return None
+
+def sniff_content(data):
+    """
+    识别订阅内容的格式并只解码一次，返回 (格式, 明文)。
+    格式为 'yaml'、'links'，经 Base64 包装的为 'base64+yaml'、'base64+links'。
+    是否为 Base64 只看前 SNIFF_SIZE 字节，其余格式判断直接在 bytes 上查找。
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    data = data.strip()
+    kind = ''
+    if BASE64_PREFIX.fullmatch(data, 0, SNIFF_SIZE):
+        decoded = decode_base64_bytes(data)
+        if decoded is not None:
+            kind, data = 'base64+', decoded
+    kind += 'yaml' if b'proxies:' in data else 'links'
+    return kind, data.decode('utf-8', 'ignore')
+
+def iter_share_links(text):
+    """逐个产出 text 中以支持的协议开头的行（去掉首尾空白）"""
+    for match in SHARE_LINK_LINE.finditer(text):
+        yield match.group(1)
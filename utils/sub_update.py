@@ -1,225 +1,111 @@
 #!/usr/bin/env python3
 
-from datetime import datetime, timedelta
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
-import json, re
+from concurrent.futures import ThreadPoolExecutor, wait
+import json, os, threading, time
 import requests
 
+from sub_discover import discover
+from sub_metrics import metrics
+
+# 部分站点会拦截默认的 python-requests UA
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+
+
+class deadline_session(requests.Session):
+    """
+    查找阶段共用的会话: 每个请求的超时不超过 timeout 秒；expire() 之后拒绝新的请求，
+    期限过后仍在后台运行的查找线程很快结束，不会再经过存档发起请求。
+    """
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+        self.expired = threading.Event()
+
+    def expire(self):
+        self.expired.set()
+
+    def request(self, method, url, **kwargs):
+        if self.expired.is_set():
+            raise requests.Timeout(f'Update deadline passed, not requesting {url}')
+        timeout = kwargs.get('timeout')
+        kwargs['timeout'] = min(timeout, self.timeout) if isinstance(timeout, (int, float)) else timeout or self.timeout
+        return super().request(method, url, **kwargs)
+
 
 class update():
-    def __init__(self,config={'list_file': './sub/sub_list.json'}):
+    def __init__(self,config={'list_file': './sub/sub_list.json'},archive=None):
         self.list_file = config['list_file']
+        # 查找阶段的期限（秒），到期未完成的源保持原链接；单个请求的超时另由 update_timeout 限制
+        self.deadline = float(config.get('update_deadline') or 60)
+        self.timeout = float(config.get('update_timeout') or 10)
         with open(self.list_file, 'r', encoding='utf-8') as f: # 载入订阅链接
             raw_list = json.load(f)
             self.raw_list = raw_list
+        self.elapsed = {} # 每个源查找所用的时间，写入运行报告
+        # 所有源共用一个带连接池的会话
+        self.session = deadline_session(self.timeout)
+        self.session.headers.update(HEADERS)
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32))
+        if archive:
+            archive.mount(self.session) # 录制或回放所有请求
         self.update_main()
 
-    def url_updated(self,url): # 判断远程链接是否已经更新
-        s = requests.Session()
+    def find_update(self, sub):
+        """按 sub_list.json 中声明的 discover 规则查找单个源的新链接，返回新链接或 None"""
+        rule = sub.get('discover')
+        if not rule:
+            print(f'ID{sub["id"]} has no discover rule, url not changed.')
+            return None
+        start = time.perf_counter()
         try:
-            resp = s.get(url, timeout=2)
-            status = resp.status_code
-        except Exception:
-            status = 404
-        if status == 200:
-            url_updated = True
-        else:
-            url_updated = False
-        return url_updated
+            return discover(rule, self.session)
+        finally:
+            self.elapsed[sub['id']] = round(time.perf_counter() - start, 3)
 
     def update_main(self):
+        pending = {}
         for sub in self.raw_list:
-            id = sub['id']
-            current_url = sub['url']
-            try:
-                if sub['update_method'] != 'auto' and sub['enabled'] == True:
-                    print(f'Finding available update for ID{id}')
-                    if sub['update_method'] == 'change_date':
-                        new_url = self.change_date(id,current_url)
-                        if new_url == current_url:
-                            print(f'No available update for ID{id}\n')
-                        else:
-                            sub['url'] = new_url
-                            print(f'ID{id} url updated to {new_url}\n')
-                    elif sub['update_method'] == 'page_release':
-                        new_url = self.find_link(id,current_url)
-                        if new_url == current_url:
-                            print(f'No available update for ID{id}\n')
-                        else:
-                            sub['url'] = new_url
-                            print(f'ID{id} url updated to {new_url}\n')
-            except KeyError:
-                print(f'{id} Url not changed! Please define update method.')
-            
-            updated_list = json.dumps(self.raw_list, sort_keys=False, indent=2, ensure_ascii=False)
-            file = open(self.list_file, 'w', encoding='utf-8')
-            file.write(updated_list)
-            file.close()
-
-    def change_date(self,id,current_url):
-        if id == 0:
-            today = datetime.today().strftime('%m%d')
-            url_front = 'https://raw.githubusercontent.com/pojiezhiyuanjun/freev2/master/'
-            url_end = '.txt'
-            new_url = url_front + today + url_end
-            
-        if id == 7:
-            try:
-                import requests
-                import re
-                from datetime import datetime, timedelta
-
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                }
-                for delta in [0, 1]:
-                    date_str = (datetime.today() - timedelta(days=delta)).strftime('%Y%m%d')
-                    page_url = f'https://clashfreenode.com/a/fn{date_str}.html'
-                    
-                    try:
-                        res = requests.get(page_url, headers=headers, timeout=10)
-                        if res.status_code == 200:
-                            pattern = rf'https://nodebus\.net/cfn-new/[a-zA-Z0-9]+/{date_str}-v2ray\.txt'
-                            match = re.search(pattern, res.text)
-                            
-                            if match:
-                                new_url = match.group(0)
-                                if self.url_updated(new_url):
-                                    return new_url
-                                break
-                    except Exception:
-                        continue
-
-            except Exception as e:
-                print(f"ID 7 获取最新链接失败: {e}")  
-            return current_url
-            
-        if id == 111:
-            this_month = datetime.today().strftime('%m').lstrip('0')
-            today = datetime.today().strftime('%d').lstrip('0')
-            yesterday = (datetime.today() - timedelta(days=1)).strftime('%d').lstrip('0')
-            url = f"https://agit.ai/231/123321312/src/branch/master/{this_month}"
-            response = requests.get(url)
-            soup = BeautifulSoup(response.content, "html.parser")
-            latest_URL = None
-            new_url = None
-            new_url_today = None
-            new_url_yesterday = None
-            for row in soup.find_all("tr"):
-                link = row.find("a")
-                if link and f"{this_month}" in link.text and f"{today}" in link.text and "yml" not in link.text: 
-                    latest_URL = f"{url}/{link.text}"
-                    new_url_today = latest_URL.replace("/src/", "/raw/")
-                else:
-                    if link and f"{this_month}" in link.text and f"{yesterday}" in link.text and "yml" not in link.text: 
-                        latest_URL = f"{url}/{link.text}"
-                        new_url_yesterday = latest_URL.replace("/src/", "/raw/")
-            if new_url_today:
-                new_url = new_url_today
-            else:
-                new_url = new_url_yesterday
-           
-        if id == 28:
-            url_date = datetime.today().strftime('%Y%m%d')
-            url = "https://www.cfmem.com/"
-            response = requests.get(url)
-            soup = BeautifulSoup(response.text, "html.parser")
-            link = soup.find("a", href=lambda href: href and url_date in href)
-            new_url = None
-            if link:
-                link_url = link["href"]
-                link_response = requests.get(link_url)
-                link_soup = BeautifulSoup(link_response.text, "html.parser")
-                new_url = None
-                for string in link_soup.stripped_strings:
-                    if string.startswith("v2ray订阅链接") and string.endswith(".txt"):
-                        start = string.index("https://")
-                        end = string.index(".txt") + 4
-                        new_url = string[start:end]
-                        break
-        if id == 32:
-            today = datetime.today().strftime('%Y%m%d')
-            this_month = datetime.today().strftime('%m')
-            this_year = datetime.today().strftime('%Y')
-            url_front = 'https://nodefree.org/dy/'
-            url_end = '.txt'
-            new_url = url_front + this_year + '/' + this_month + '/' + today + url_end
-        if id == 40:
-            new_url = datetime.today().strftime('https://clashgithub.com/wp-content/uploads/rss/%Y%m%d.txt')
-            if self.url_updated(new_url):
-                return new_url
-            else:
-                return current_url
-        if id == 36:
-            today = datetime.today().strftime('%Y%m%d')
-            this_month = datetime.today().strftime('%m')
-            this_year = datetime.today().strftime('%Y')
-            url_front = 'https://nodefree.org/dy/'
-            url_end = '.txt'
-            new_url = url_front + this_year + '/' + this_month + '/' + today + url_end
-
-            if self.url_updated(new_url):
-                return new_url
-            else:
-                return current_url
-
-    def find_link(self, id, current_url):
-  
-        if id == 18:
-            try:
-                # 请求 GitHub API 获取文件列表
-                api_url = "https://api.github.com/repos/free-nodes/v2rayfree/contents/"
-                resp = requests.get(api_url, timeout=5)
-                
-                if resp.status_code == 200:
-                    res_json = resp.json()
-                    
-                    # 筛选逻辑：
-                    # 1. 排除 README.md
-                    # 2. 根据数据特征，文件均以 'v' 开头 (如 v202602122)
-                    target_files = [f for f in res_json if f['name'].startswith('v')]
-                    
-                    if target_files:
-                        # 按文件名降序排列 (字符串排序: v202602122 > v202602121)
-                        target_files.sort(key=lambda x: x['name'], reverse=True)
-                        
-                        # 返回最新文件的 raw 下载链接
-                        return target_files[0]['download_url']
-                    else:
-                        return current_url
-                return current_url
-            except Exception:
-                return current_url
-                
-        if id == 33:
-            url_update = 'https://v2cross.com/archives/1884'
-
-            if self.url_updated(url_update):
+            if 'update_method' not in sub:
+                print(f'{sub["id"]} Url not changed! Please define update method.')
+            elif sub['update_method'] != 'auto' and sub['enabled'] == True:
+                pending[sub['id']] = sub
+        if pending:
+            print(f'Finding available update for ID{", ID".join(str(id) for id in pending)}\n')
+            # 每个源一个线程同时开始查找，慢的站点不会拖住整个更新阶段
+            executor = ThreadPoolExecutor(max_workers=len(pending))
+            futures = {executor.submit(self.find_update, sub): id for id, sub in pending.items()}
+            done, not_done = wait(futures, timeout=self.deadline)
+            # 期限到后丢弃迟到的结果：不再发起请求，未完成的源按超时处理
+            self.session.expire()
+            executor.shutdown(wait=False, cancel_futures=True)
+            for future, id in futures.items():
+                sub = pending[id]
+                if future in not_done:
+                    metrics.source('update', id=id, seconds=self.deadline, outcome='timeout', error_class='Timeout')
+                    print(f'ID{id} timed out after {self.deadline:g}s, url not changed\n')
+                    continue
                 try:
-                    resp = requests.get(url_update, timeout=5)
-                    raw_content = resp.text
-
-                    raw_content = raw_content.replace('amp;', '')
-                    pattern = re.compile(r'https://shadowshare.v2cross.com/publicserver/servers/temp/\w{16}')
-                    
-                    new_url = re.findall(pattern, raw_content)[0]
-                    return new_url
-                except Exception:
-                    return current_url
-            else:
-                return current_url
-                
-        if id == 38:
-            try:
-                res_json = requests.get('https://api.github.com/repos/mianfeifq/share/contents/').json()
-                for file in res_json:
-                    if file['name'].startswith('data'):
-                        return file['download_url'] 
+                    new_url = future.result()
+                except Exception as e:
+                    metrics.source('update', id=id, seconds=self.elapsed.get(id), outcome='error', error_class=e.__class__.__name__)
+                    print(f'ID{id} failed to find update: {e}\n')
+                    continue
+                if not new_url or new_url == sub['url']:
+                    metrics.source('update', id=id, seconds=self.elapsed.get(id), outcome='unchanged', error_class=None)
+                    print(f'No available update for ID{id}\n')
                 else:
-                    return current_url
-            except Exception:
-                return current_url
+                    metrics.source('update', id=id, seconds=self.elapsed.get(id), outcome='updated', error_class=None)
+                    sub['url'] = new_url
+                    print(f'ID{id} url updated to {new_url}\n')
+
+        # 全部处理完后一次性写回，先写临时文件再替换，避免中途失败留下半个文件
+        updated_list = json.dumps(self.raw_list, sort_keys=False, indent=2, ensure_ascii=False)
+        temp_file = self.list_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            file.write(updated_list)
+        os.replace(temp_file, self.list_file)
 
 if __name__ == '__main__':
     update()
@@ -1 +1 @@
-from .subconvert import convert, base64_decode
+from .subconvert import convert, convert_many, subconverter_server, base64_decode
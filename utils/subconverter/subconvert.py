@@ -1,77 +1,152 @@
-# utils/subconverter/subconvert.py 最终高效版
+# utils/subconverter/subconvert.py 常驻服务版
 
-import os, subprocess, base64
+import os, subprocess, base64, atexit, contextlib, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+try:
+    from sub_metrics import metrics # 由 main.py 调用时记录到运行报告
+except ImportError:
+    metrics = None
+
+SUBCONVERTER_DIR = os.path.dirname(os.path.abspath(__file__))
+EXECUTABLE = 'subconverter-linux-amd64' if os.name == 'posix' else 'subconverter-windows-amd64.exe'
+
+def server_port(default=25500):
+    """读取 pref.toml 中 [server] 的端口"""
+    try:
+        import tomllib
+        with open(os.path.join(SUBCONVERTER_DIR, 'pref.toml'), 'rb') as f:
+            return int(tomllib.load(f).get('server', {}).get('port', default))
+    except Exception:
+        return default
+
+class subconverter_server():
+    """
+    管理一个常驻的本地 subconverter HTTP 服务（读取同目录的 pref.toml）。
+    所有转换通过同一个保持连接的会话发出，可以在多个线程中同时调用 convert。
+    """
+    def __init__(self, port=None, host='127.0.0.1'):
+        self.port = port or server_port()
+        self.base_url = f'http://{host}:{self.port}'
+        self.process = None
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
+    def healthy(self):
+        try:
+            return self.session.get(f'{self.base_url}/version', timeout=2).status_code == 200
+        except Exception:
+            return False
+
+    def start(self, timeout=20):
+        """启动服务并等待健康检查通过；已在运行时直接返回"""
+        with self.lock:
+            if self.process and self.process.poll() is None and self.healthy():
+                return
+            self.stop()
+            # 用 cwd 指定工作目录，不修改全局的 os.getcwd()
+            self.process = subprocess.Popen(
+                [os.path.join(SUBCONVERTER_DIR, EXECUTABLE)],
+                cwd=SUBCONVERTER_DIR,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f'Subconverter exited with code {self.process.returncode}')
+                if self.healthy():
+                    return
+                time.sleep(0.2)
+            self.stop()
+            raise RuntimeError(f'Subconverter did not become healthy within {timeout}s')
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def convert(self, input_content, input_type, target_format, config={}):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        temp_file = None
+        try:
+            if input_type == 'url':
+                url = input_content
+            elif input_type == 'base64':
+                # 服务端只接受链接或本地文件，base64 内容写入独立的临时文件，并发调用互不影响
+                fd, temp_file = tempfile.mkstemp(suffix='.txt', dir=SUBCONVERTER_DIR)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(input_content)
+                url = temp_file
+            else:
+                raise ValueError(f"Unsupported input_type: {input_type}")
+
+            params = {'target': target_format, 'url': url}
+            for key in ('rename', 'include', 'exclude', 'config'):
+                if config.get(key): params[key] = config[key]
+            resp = self.session.get(f'{self.base_url}/sub', params=params, timeout=120)
+            if resp.status_code != 200:
+                print(f"  -> Subconverter failed for input. Response: {resp.status_code} {resp.text.strip()[:200]}")
+                return ""
+            resp.encoding = 'utf-8'
+            return resp.text
+        finally:
+            if temp_file and os.path.exists(temp_file):
+                os.remove(temp_file)
+
+_server = None
+_server_lock = threading.Lock()
+
+def get_server():
+    """返回共享的服务实例，首次调用时启动，进程退出时自动关闭"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = subconverter_server()
+            atexit.register(_server.stop)
+        return _server
 
 def convert(input_content, input_type, target_format, config={}):
     """
-    【高效版】接收输入内容和类型，调用 subconverter 核心，并返回输出内容。
+    【常驻服务版】接收输入内容和类型，交给本地 subconverter 服务转换，并返回输出内容。
     - input_content: URL, 本地文件路径, 或 Base64 编码的字符串
     - input_type: 'url' 或 'base64'
-    - target_format: 'clash' 或 'base64'
+    - target_format: 'clash' 或 'base64' 等 subconverter 支持的 target
     - config: 包含过滤、重命名规则的字典
     """
-    work_dir = os.getcwd()
-    subconverter_dir = os.path.dirname(os.path.abspath(__file__))
-    os.chdir(subconverter_dir)
-
-    # 准备一个临时的输出文件
-    temp_output_file = './temp_output_artifact.tmp'
-    
-    output = ""
-    try:
-        executable = 'subconverter-linux-amd64' if os.name == 'posix' else 'subconverter-windows-amd64.exe'
-        command = [
-            f'./{executable}',
-            '--no-color',
-            '--target', target_format,
-            '--output', temp_output_file
-        ]
-
-        # 根据输入类型构建命令
-        # 注意：对于 'url' 类型，input_content 就是 URL 或文件路径
-        # 对于 'base64' 类型，subconverter 期望从 stdin 读取
-        if input_type == 'url':
-            command.extend(['--url', input_content])
-            stdin_content = None
-        elif input_type == 'base64':
-            stdin_content = input_content.encode('utf-8')
-        else:
-            raise ValueError(f"Unsupported input_type: {input_type}")
-
-        # 添加其他配置
-        if config.get('rename'): command.extend(['--rename', config['rename']])
-        if config.get('include'): command.extend(['--include', config['include']])
-        if config.get('exclude'): command.extend(['--exclude', config['exclude']])
-        if config.get('config'): command.extend(['--config', config['config']])
-        
-        process = subprocess.run(
-            command,
-            input=stdin_content,
-            capture_output=True,
-            text=True,
-            encoding='utf-8',
-            timeout=120 # 单次转换超时2分钟，足够了
-        )
-
-        if process.returncode != 0:
-            print(f"  -> Subconverter failed for input. Stderr: {process.stderr.strip()}")
-            return ""
-
-        if os.path.exists(temp_output_file):
-            with open(temp_output_file, 'r', encoding='utf-8', errors='ignore') as f:
-                output = f.read()
-            os.remove(temp_output_file)
-        else:
-             print(f"  -> Warning: Output file was not created by subconverter.")
-
-    except subprocess.TimeoutExpired:
-        print(f"  -> Subconverter timed out processing the input.")
-    except Exception as e:
-        print(f"  -> An error occurred while running subconverter: {e}")
-    finally:
-        os.chdir(work_dir)
-
-    return output
+    with metrics.stage(f'subconverter.{target_format}') if metrics else contextlib.nullcontext():
+        try:
+            return get_server().convert(input_content, input_type, target_format, config)
+        except requests.Timeout:
+            print(f"  -> Subconverter timed out processing the input.")
+        except Exception as e:
+            print(f"  -> An error occurred while running subconverter: {e}")
+        if metrics:
+            metrics.count('subconverter.errors')
+        return ""
+
+def convert_many(jobs, max_workers=4):
+    """
+    并行执行多个转换，jobs 为 convert 参数元组的列表，按顺序返回输出。
+    例如 [(content, 'base64', 'clash'), (content, 'base64', 'mixed')]
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda job: convert(*job), jobs))
 
 
 def base64_decode(content):